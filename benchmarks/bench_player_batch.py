@@ -0,0 +1,441 @@
+"""PlayerBatch 性能基准
+
+使用模拟的 PluginServerInterface 驱动 PlayerBatch，不需要真实的 Minecraft 服务端，
+可离线运行（需要安装 mcdreforged）。对每种命令（base / l / s / init / stop）和每个规模
+统计命令分发速率、加入到首个动作的延迟、峰值线程数和峰值内存。
+
+用法:
+    python benchmarks/bench_player_batch.py
+    python benchmarks/bench_player_batch.py --sizes 10 100 --kinds base init --output new.json
+    python benchmarks/bench_player_batch.py --compare old.json new.json
+"""
+import argparse
+import collections
+import heapq
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SPAWN_PATTERN = re.compile(r'player (\S+) spawn')
+KILL_PATTERN = re.compile(r'player (\S+) kill')
+ACTION_PATTERN = re.compile(r'player (\S+) (?!spawn|kill)\S+')
+HEALTH_PATTERN = re.compile(r'^/?(?:tick|profile) (?:health|query)')
+
+
+class FakeLogger:
+    def __init__(self):
+        self.count = 0
+
+    def _log(self, msg, *args, **kwargs):
+        self.count += 1
+
+    info = warning = error = debug = _log
+
+
+class FakePlayerList:
+    def __init__(self, players):
+        self.players = list(players)
+        self.amount = len(self.players)
+
+
+class FakeDataApi:
+    """模拟 minecraft_data_api，在线列表直接来自模拟服务端"""
+
+    def __init__(self, server: 'FakeServer'):
+        self.server = server
+        self.list_calls = 0
+
+    def get_server_player_list(self, timeout=None):
+        self.list_calls += 1
+        with self.server.lock:
+            return FakePlayerList(self.server.online)
+
+
+class FakeInfo:
+    """模拟的服务端输出行"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.is_from_server = True
+        self.player = None
+
+
+class FakeServer:
+    """模拟的 PluginServerInterface
+
+    记录每次 execute 的时间戳；spawn 命令在 join_delay 秒后由单个模拟线程触发加入事件，
+    kill 命令立即触发离开事件。rcon=True 时同时充当本地 RCON 替身：rcon_query 执行命令并返回
+    Carpet 风格的反馈，已在线的假人再次生成会得到 "is already logged on" 错误。
+    tick 健康信息命令按 script_mspt() 设置的 MSPT 依次回报（最后一个值重复使用），
+    通过控制台时作为服务端输出交给插件的 on_info，通过 RCON 时作为执行结果返回。
+    """
+
+    def __init__(self, join_delay: float, rcon: bool = False):
+        self.logger = FakeLogger()
+        self.join_delay = join_delay
+        self.rcon = rcon
+        self.data_folder = tempfile.mkdtemp(prefix='plb_bench_')
+        self.executed = []  # [(timestamp, command)]
+        self.joined_at = {}  # {bot_name: timestamp}
+        self.online = set()
+        self.lock = threading.Lock()
+        self.data_api = FakeDataApi(self)
+        self.plugin = None
+        self.mspt = collections.deque([10.0])
+        self._joins = []
+        self._join_cond = threading.Condition()
+        self._running = True
+        self._join_thread = threading.Thread(target=self._join_loop, name='FakeServer-Join', daemon=True)
+        self._join_thread.start()
+
+    # PluginServerInterface
+    def get_data_folder(self):
+        return self.data_folder
+
+    def get_mcdr_config(self):
+        return {'working_directory': self.data_folder}
+
+    def get_plugin_instance(self, plugin_id):
+        return self.data_api if plugin_id == 'minecraft_data_api' else None
+
+    def register_help_message(self, *args, **kwargs):
+        pass
+
+    def register_command(self, *args, **kwargs):
+        pass
+
+    def register_event_listener(self, *args, **kwargs):
+        pass
+
+    def is_server_running(self):
+        return self._running
+
+    def is_rcon_running(self):
+        return self.rcon
+
+    def script_mspt(self, values):
+        with self.lock:
+            self.mspt = collections.deque(values)
+
+    def health_report(self, command: str):
+        """tick 健康信息命令的输出，其他命令返回 None"""
+        if HEALTH_PATTERN.match(command) is None:
+            return None
+        with self.lock:
+            mspt = self.mspt.popleft() if len(self.mspt) > 1 else self.mspt[0]
+        return f'Average tick time: {mspt:.1f}ms'
+
+    def rcon_query(self, command):
+        if not self.rcon:
+            return None
+        report = self.health_report(command)
+        if report is not None:
+            with self.lock:
+                self.executed.append((time.perf_counter(), command))
+            return report
+        match = SPAWN_PATTERN.search(command)
+        if match is not None:
+            with self.lock:
+                online = match.group(1) in self.online
+            if online:
+                with self.lock:
+                    self.executed.append((time.perf_counter(), command))
+                return f'Player {match.group(1)} is already logged on'
+        self.execute(command)
+        return ''
+
+    def execute(self, text, **kwargs):
+        now = time.perf_counter()
+        with self.lock:
+            self.executed.append((now, text))
+        report = self.health_report(text)
+        if report is not None:
+            if self.plugin is not None:
+                self.plugin.on_info(FakeInfo(report))
+            return
+        match = SPAWN_PATTERN.search(text)
+        if match is not None:
+            with self._join_cond:
+                heapq.heappush(self._joins, (now + self.join_delay, match.group(1)))
+                self._join_cond.notify()
+            return
+        match = KILL_PATTERN.search(text)
+        if match is not None:
+            with self.lock:
+                self.online.discard(match.group(1))
+            if self.plugin is not None:
+                self.plugin.on_player_left(match.group(1))
+
+    def _join_loop(self):
+        while True:
+            with self._join_cond:
+                while self._running and (not self._joins or self._joins[0][0] > time.perf_counter()):
+                    timeout = self._joins[0][0] - time.perf_counter() if self._joins else None
+                    self._join_cond.wait(timeout)
+                if not self._running:
+                    return
+                _, bot_name = heapq.heappop(self._joins)
+            with self.lock:
+                self.online.add(bot_name)
+                self.joined_at.setdefault(bot_name, time.perf_counter())
+            if self.plugin is not None:
+                self.plugin.on_bot_joined(bot_name)
+
+    def close(self):
+        with self._join_cond:
+            self._running = False
+            self._join_cond.notify_all()
+        shutil.rmtree(self.data_folder, ignore_errors=True)
+
+
+class FakeSource:
+    """模拟的控制台命令源"""
+
+    def __init__(self):
+        self.is_player = False
+        self.player = None
+        self.replies = []
+        self.replied = threading.Event()
+
+    def reply(self, message):
+        self.replies.append(message)
+        self.replied.set()
+
+    def has_permission(self, level):
+        return True
+
+    def get_permission_level(self):
+        return 4
+
+
+class Sampler:
+    """后台采样峰值线程数（不含采样线程自身）"""
+
+    def __init__(self, period: float = 0.005):
+        self.period = period
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='Bench-Sampler', daemon=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            self._stop.wait(self.period)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def wait_started(plugin, src: FakeSource, timeout: float) -> bool:
+    """等待命令创建任务（l / s 在调度器线程中创建）或回复结果（出错或已经完成）"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if plugin.jobs or src.replied.is_set():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def wait_idle(plugin, server: FakeServer, timeout: float, quiet: float = 0.3) -> bool:
+    """等待所有任务结束且 quiet 秒内没有新命令"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        with server.lock:
+            last = server.executed[-1][0] if server.executed else 0
+        if not plugin.jobs and not len(plugin.bot_states) and time.perf_counter() - last >= quiet:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def start_command(plugin, src, kind: str, size: int):
+    if kind == 'base':
+        plugin.process_command(src, {'name': 'b', 'start': 1, 'end': size, 'action_args': 'spawn'})
+    elif kind == 'l':
+        plugin.process_line_command(src, {'name': 'l', 'start': 1, 'length': size, 'direction': '+x', 'interval': 2})
+    elif kind == 's':
+        width = max(1, int(size ** 0.5))
+        plugin.process_square_command(src, {
+            'name': 's', 'start': 1, 'long': (size + width - 1) // width, 'width': width,
+            'direction1': '+x', 'direction2': '+z', 'interval': 2
+        })
+    else:
+        plugin.process_init_command(src, {
+            'name': 'i', 'start': 1, 'length': size, 'interval1': 0, 'interval2': 0,
+            'x': 0, 'y': 100, 'z': 0, 'action': 'use'
+        })
+
+
+def run_case(kind: str, size: int, args) -> dict:
+    from player_batch.main import PlayerBatch
+
+    server = FakeServer(args.join_delay, args.rcon)
+    plugin = PlayerBatch(server)
+    server.plugin = plugin
+    plugin.on_load()
+    plugin.config['use_rcon'] = args.rcon
+    plugin.config['interval'] = args.interval
+    plugin.config['init_window'] = args.init_window
+    src = FakeSource()
+
+    tracemalloc.start()
+    with Sampler() as sampler:
+        started = time.perf_counter()
+        if kind == 'stop':
+            # 先启动一个带间隔的大批量 init，随后停止，测量停止生效的延迟
+            plugin.config['init_window'] = min(args.init_window, size)
+            start_command(plugin, src, 'init', size)
+            wait_started(plugin, src, args.timeout)
+            time.sleep(args.stop_after)
+            stop_at = time.perf_counter()
+            plugin.process_stop_command(FakeSource())
+            stop_returned = time.perf_counter()
+            completed = wait_idle(plugin, server, args.timeout)
+        else:
+            start_command(plugin, src, kind, size)
+            completed = wait_started(plugin, src, args.timeout) and wait_idle(plugin, server, args.timeout)
+        finished = time.perf_counter()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with server.lock:
+        executed = list(server.executed)
+    commands = len(executed)
+    dispatch_span = executed[-1][0] - executed[0][0] if commands > 1 else 0.0
+
+    result = {
+        'kind': kind,
+        'size': size,
+        'completed': completed,
+        'commands': commands,
+        'wall_time': round(finished - started, 4),
+        'commands_per_sec': round(commands / dispatch_span, 1) if dispatch_span > 0 else None,
+        'first_command_latency_ms': round((executed[0][0] - started) * 1000, 3) if executed else None,
+        'join_to_first_action_ms': None,
+        'peak_threads': sampler.peak_threads,
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+        'list_queries': server.data_api.list_calls,
+        'log_lines': server.logger.count
+    }
+
+    # 加入到首个动作的延迟（只有 init 有加入后的动作阶段）
+    first_action = {}
+    for timestamp, command in executed:
+        match = ACTION_PATTERN.search(command)
+        if match is not None:
+            first_action.setdefault(match.group(1), timestamp)
+    latencies = sorted(
+        (first_action[bot] - joined) * 1000
+        for bot, joined in server.joined_at.items() if bot in first_action and first_action[bot] >= joined
+    )
+    if latencies:
+        result['join_to_first_action_ms'] = {
+            'p50': round(latencies[len(latencies) // 2], 3),
+            'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+            'max': round(latencies[-1], 3)
+        }
+
+    if kind == 'stop':
+        after_stop = [timestamp for timestamp, _ in executed if timestamp > stop_returned]
+        result['stop_call_ms'] = round((stop_returned - stop_at) * 1000, 3)
+        result['commands_after_stop'] = len(after_stop)
+        result['stop_to_quiet_ms'] = round(((after_stop[-1] if after_stop else stop_returned) - stop_at) * 1000, 3)
+
+    plugin.on_unload()
+    server.close()
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def format_row(result: dict) -> str:
+    latency = result['join_to_first_action_ms']
+    latency_text = f'{latency["p50"]:.1f}/{latency["p95"]:.1f}' if latency else '-'
+    rate = result['commands_per_sec']
+    return (f'{result["kind"]:<5} {result["size"]:>6} {result["commands"]:>7} {result["wall_time"]:>9.3f} '
+            f'{rate if rate is not None else "-":>11} {latency_text:>13} {result["peak_threads"]:>7} '
+            f'{result["peak_memory_kb"]:>10.1f} {"" if result["completed"] else "TIMEOUT"}')
+
+
+HEADER = (f'{"kind":<5} {"size":>6} {"cmds":>7} {"wall(s)":>9} {"cmds/s":>11} {"join->act ms":>13} '
+          f'{"threads":>7} {"peak KB":>10}')
+
+
+def compare(old_file: str, new_file: str):
+    with open(old_file) as f:
+        old = {(r['kind'], r['size']): r for r in json.load(f)['results']}
+    with open(new_file) as f:
+        new_data = json.load(f)
+    print(f'{"kind":<5} {"size":>6} {"metric":<18} {"old":>12} {"new":>12} {"change":>9}')
+    for result in new_data['results']:
+        before = old.get((result['kind'], result['size']))
+        if before is None:
+            continue
+        for metric in ('wall_time', 'commands_per_sec', 'peak_threads', 'peak_memory_kb'):
+            a, b = before.get(metric), result.get(metric)
+            if a is None or b is None:
+                continue
+            change = f'{(b - a) / a * 100:+.1f}%' if a else '-'
+            print(f'{result["kind"]:<5} {result["size"]:>6} {metric:<18} {a:>12} {b:>12} {change:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PlayerBatch benchmark with a fake server')
+    parser.add_argument('--kinds', nargs='+', default=['base', 'l', 's', 'init', 'stop'],
+                        choices=['base', 'l', 's', 'init', 'stop'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument('--interval', type=float, default=0.0, help='config interval used for the runs')
+    parser.add_argument('--init-window', type=int, default=100, help='config init_window used for init/stop')
+    parser.add_argument('--join-delay', type=float, default=0.05, help='simulated spawn-to-join delay')
+    parser.add_argument('--stop-after', type=float, default=0.5, help='seconds before issuing stop')
+    parser.add_argument('--timeout', type=float, default=600.0, help='per-case timeout')
+    parser.add_argument('--rcon', action='store_true', help='dispatch through the fake RCON stand-in')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    results = []
+    print(HEADER)
+    for kind in args.kinds:
+        for size in args.sizes:
+            result = run_case(kind, size, args)
+            results.append(result)
+            print(format_row(result), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'options': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+                'results': results
+            }, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""PlayerBatch 自适应命令间隔检查
+
+使用 bench_player_batch 中模拟的服务端按脚本回报 MSPT，分别通过控制台输出和 RCON 执行结果驱动
+自适应命令间隔（adaptive_interval），对 floor 和 ceiling 两种 bound 检查：
+    - MSPT 高于 target_mspt 时间隔变大，低于 0.8×target_mspt 时间隔变小，介于两者之间时不变
+    - 间隔始终在 [lower, upper] 内，并且能够到达两端
+    - 每次取间隔都发送了一次 health_command
+    - 批量命令之间的实际等待跟随调整后的间隔
+
+用法:
+    python benchmarks/check_adaptive_interval.py
+    python benchmarks/check_adaptive_interval.py --steps 50 --bots 20
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_player_batch import FakeServer, FakeSource, SPAWN_PATTERN, HEALTH_PATTERN
+
+TARGET_MSPT = 40.0
+HIGH_MSPT = 80.0
+MIDDLE_MSPT = 35.0  # 介于 0.8×target 与 target 之间
+LOW_MSPT = 10.0
+
+
+def make_plugin(bound: str, rcon: bool, interval: float, min_interval: float, max_interval: float):
+    from player_batch.main import PlayerBatch
+
+    server = FakeServer(join_delay=0.01, rcon=rcon)
+    plugin = PlayerBatch(server)
+    server.plugin = plugin
+    plugin.on_load()
+    plugin.config['use_rcon'] = rcon
+    plugin.config['interval'] = interval
+    plugin.config['adaptive_interval'].update({
+        'enabled': True, 'bound': bound, 'target_mspt': TARGET_MSPT,
+        'min_interval': min_interval, 'max_interval': max_interval, 'sample_period': 0
+    })
+    plugin.setup_rate_controller()
+    return server, plugin
+
+
+def health_commands(server: FakeServer) -> int:
+    with server.lock:
+        return sum(1 for _, command in server.executed if HEALTH_PATTERN.match(command))
+
+
+def check_controller(bound: str, rcon: bool, steps: int) -> list:
+    """逐次回报 MSPT 并取间隔，检查每一步的调整方向和边界"""
+    interval, min_interval, max_interval = 0.2, 0.02, 1.0
+    server, plugin = make_plugin(bound, rcon, interval, min_interval, max_interval)
+    expected = (interval, max_interval) if bound == 'floor' else (min_interval, interval)
+    controller = plugin.rate_controller
+    problems = []
+    name = f'{bound}/{"rcon" if rcon else "console"}'
+    if (controller.lower, controller.upper) != expected:
+        problems.append(f'{name}: bounds {(controller.lower, controller.upper)}, expected {expected}')
+    lower, upper = expected
+
+    schedule = [LOW_MSPT] * steps + [HIGH_MSPT] * steps + [MIDDLE_MSPT] * 3 + [LOW_MSPT] * steps
+    previous = controller.interval
+    reached = set()
+    for step, mspt in enumerate(schedule):
+        server.script_mspt([mspt])
+        current = plugin.next_interval()
+        if not lower - 1e-9 <= current <= upper + 1e-9:
+            problems.append(f'{name} step {step}: interval {current:.4f} outside [{lower}, {upper}]')
+        if mspt > TARGET_MSPT and not (current > previous or previous >= upper - 1e-9):
+            problems.append(f'{name} step {step}: MSPT {mspt} did not slow down ({previous:.4f} -> {current:.4f})')
+        if mspt < TARGET_MSPT * 0.8 and not (current < previous or previous <= lower + 1e-9):
+            problems.append(f'{name} step {step}: MSPT {mspt} did not speed up ({previous:.4f} -> {current:.4f})')
+        if TARGET_MSPT * 0.8 <= mspt <= TARGET_MSPT and current != previous:
+            problems.append(f'{name} step {step}: MSPT {mspt} changed the interval ({previous:.4f} -> {current:.4f})')
+        if abs(current - lower) < 1e-9:
+            reached.add('lower')
+        if abs(current - upper) < 1e-9:
+            reached.add('upper')
+        previous = current
+    for end in ('lower', 'upper'):
+        if end not in reached:
+            problems.append(f'{name}: interval never reached the {end} bound')
+    if controller.last_mspt != schedule[-1]:
+        problems.append(f'{name}: last MSPT sample {controller.last_mspt}, expected {schedule[-1]}')
+    sent = health_commands(server)
+    if sent != len(schedule):
+        problems.append(f'{name}: {sent} health commands sent for {len(schedule)} samples')
+
+    print(f'controller {name}: {len(schedule)} samples, bounds [{lower}, {upper}], {len(problems)} problems', flush=True)
+    plugin.on_unload()
+    server.close()
+    return problems
+
+
+def check_batch(bound: str, rcon: bool, bots: int) -> list:
+    """在真实的批量生成中检查命令之间的等待跟随 MSPT 调整：floor 下持续过载时放慢，ceiling 下空闲时加快"""
+    if bound == 'floor':
+        interval, min_interval, max_interval, mspt = 0.01, 0.01, 0.1, HIGH_MSPT
+    else:
+        interval, min_interval, max_interval, mspt = 0.1, 0.01, 1.0, LOW_MSPT
+    server, plugin = make_plugin(bound, rcon, interval, min_interval, max_interval)
+    server.script_mspt([mspt])
+    src = FakeSource()
+    name = f'{bound}/{"rcon" if rcon else "console"}'
+    plugin.process_command(src, {'name': 'a', 'start': 1, 'end': bots, 'action_args': 'spawn'})
+    src.replied.wait(bots * max_interval * 2 + 5)
+    with server.lock:
+        spawns = [timestamp for timestamp, command in server.executed if SPAWN_PATTERN.search(command)]
+    plugin.on_unload()
+    server.close()
+
+    problems = []
+    if len(spawns) != bots:
+        return [f'batch {name}: {len(spawns)}/{bots} spawn commands sent']
+    gaps = [b - a for a, b in zip(spawns, spawns[1:])]
+    first, last = gaps[0], sum(gaps[-3:]) / 3
+    # 最后几次等待应接近对应的边界，而不是配置的固定间隔
+    if bound == 'floor' and not (last >= max_interval * 0.8 and last > interval * 3):
+        problems.append(f'batch {name}: gaps did not grow under load ({first * 1000:.1f}ms -> {last * 1000:.1f}ms)')
+    if bound == 'ceiling' and not (last <= min_interval * 3 and last < interval / 3):
+        problems.append(f'batch {name}: gaps did not shrink when idle ({first * 1000:.1f}ms -> {last * 1000:.1f}ms)')
+    print(f'batch {name}: {bots} spawns, gap {first * 1000:.1f}ms -> {last * 1000:.1f}ms, '
+          f'{len(problems)} problems', flush=True)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the MSPT-driven adaptive interval against a fake server')
+    parser.add_argument('--steps', type=int, default=30, help='samples per phase of the MSPT script')
+    parser.add_argument('--bots', type=int, default=30, help='spawns per batch check')
+    args = parser.parse_args()
+
+    problems = []
+    for bound in ('floor', 'ceiling'):
+        for rcon in (False, True):
+            problems += check_controller(bound, rcon, args.steps)
+            problems += check_batch(bound, rcon, args.bots)
+    for problem in problems[:20]:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""PlayerBatch 假人状态竞争压力测试
+
+使用 bench_player_batch 中模拟的服务端，在多个线程中对数千个假人同时触发加入（含重复加入）、
+超时、生成失败、丢弃、重新登记和全部停止，检查：
+    - 每次登记的完成回调最多触发一次，未被丢弃的登记恰好触发一次
+    - 成功完成的登记按顺序执行了全部动作，任何动作都不会被执行两次
+    - 没有错误日志，结束后状态存储为空
+
+用法:
+    python benchmarks/stress_bot_state.py
+    python benchmarks/stress_bot_state.py --bots 20000 --threads 16 --rounds 3
+"""
+import argparse
+import collections
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_player_batch import FakeServer, FakeSource, FakeLogger
+
+
+class CountingLogger(FakeLogger):
+    def __init__(self):
+        super().__init__()
+        self.errors = []
+
+    def error(self, msg, *args, **kwargs):
+        self.errors.append(msg)
+
+
+def run_round(args, seed: int) -> list:
+    from player_batch.main import PlayerBatch
+
+    rng = random.Random(seed)
+    server = FakeServer(join_delay=0)
+    server.logger = CountingLogger()
+    plugin = PlayerBatch(server)
+    plugin.on_load()
+
+    lock = threading.Lock()
+    callbacks = collections.Counter()  # {token: 回调次数}
+    results = {}  # {token: success}
+    expected = {}  # {token: [动作命令]}
+    bot_tokens = collections.defaultdict(list)  # {bot_name: [token]}
+    discarded = set()
+    crashes = []
+    tokens = itertools.count()
+
+    def register(bot_name: str):
+        with lock:
+            token = next(tokens)
+            actions = [f'/player {bot_name} use #{token}', f'/player {bot_name} jump #{token}']
+            expected[token] = actions
+            bot_tokens[bot_name].append(token)
+
+        def on_done(success, token=token):
+            with lock:
+                callbacks[token] += 1
+                results[token] = success
+
+        plugin.add_bot_action(bot_name, actions, on_done=on_done, timeout=rng.uniform(0.02, 0.2))
+
+    def discard(bot_name: str):
+        # 丢弃不触发回调，记下此时该假人的所有登记
+        with lock:
+            discarded.update(bot_tokens[bot_name])
+        plugin.discard_bot_action(bot_name)
+
+    # 每个假人的一组随机事件，按时间顺序由多个线程并发触发
+    events = []
+    for n in range(args.bots):
+        bot_name = f'stress_{n}'
+        register(bot_name)
+        for _ in range(rng.randint(1, 3)):
+            events.append((rng.uniform(0, 0.25), plugin.on_bot_joined, bot_name))
+        roll = rng.random()
+        if roll < 0.1:
+            events.append((rng.uniform(0, 0.25), plugin.on_spawn_failed, bot_name, 'stress'))
+        elif roll < 0.15:
+            events.append((rng.uniform(0, 0.25), discard, bot_name))
+        elif roll < 0.2:
+            events.append((rng.uniform(0, 0.25), register, bot_name))
+    if args.stop:
+        events.append((rng.uniform(0.05, 0.2), lambda: plugin.process_stop_command(FakeSource())))
+    events.sort(key=lambda event: event[0])
+
+    queue = collections.deque(events)
+    queue_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker():
+        while True:
+            with queue_lock:
+                if not queue:
+                    return
+                event = queue.popleft()
+            delay = started + event[0] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                event[1](*event[2:])
+            except Exception as e:
+                crashes.append(repr(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 等待超时、动作桶和回调全部结束
+    deadline = time.perf_counter() + 10
+    while time.perf_counter() < deadline and (len(plugin.bot_states) or plugin.action_buckets
+                                               or plugin.scheduler.pending()):
+        time.sleep(0.05)
+    time.sleep(0.3)
+    plugin.on_unload()
+    server.close()
+
+    problems = []
+    executed = collections.Counter(command for _, command in server.executed)
+    for token, actions in expected.items():
+        count = callbacks[token]
+        if count > 1:
+            problems.append(f'token {token}: callback fired {count} times')
+        elif count == 0 and token not in discarded:
+            problems.append(f'token {token}: callback never fired')
+        for action in actions:
+            if executed[action] > 1:
+                problems.append(f'token {token}: {action} executed {executed[action]} times')
+        if results.get(token) and not all(executed[action] == 1 for action in actions):
+            problems.append(f'token {token}: reported success without running all actions')
+    if crashes:
+        problems.append(f'{len(crashes)} events raised, first: {crashes[0]}')
+    if server.logger.errors:
+        problems.append(f'{len(server.logger.errors)} errors logged, first: {server.logger.errors[0]}')
+    if len(plugin.bot_states):
+        problems.append(f'{len(plugin.bot_states)} records left in the state store')
+
+    succeeded = sum(1 for success in results.values() if success)
+    print(f'round seed={seed}: {len(expected)} registrations, {len(events)} events, {succeeded} succeeded, '
+          f'{len(results) - succeeded} failed/timed out, {len(discarded)} discarded, '
+          f'{len(problems)} problems', flush=True)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress concurrent bot state transitions in PlayerBatch')
+    parser.add_argument('--bots', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stop', action='store_true', help='also issue a stop-all in the middle of each round')
+    args = parser.parse_args()
+
+    problems = []
+    for round_idx in range(args.rounds):
+        problems += run_round(args, args.seed + round_idx)
+    for problem in problems[:20]:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
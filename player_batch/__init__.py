@@ -1,2 +1,2 @@
-from .main import on_load
-__all__ = ['on_load']
\ No newline at end of file
+from .main import on_load, on_unload, on_player_joined, on_player_left, on_info
+__all__ = ['on_load', 'on_unload', 'on_player_joined', 'on_player_left', 'on_info']
\ No newline at end of file
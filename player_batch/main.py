@@ -1,154 +1,1697 @@
 from mcdreforged.api.all import *
 import os
+import re
+import csv
 import json
+import math
 import time
+import heapq
+import random
+import hashlib
+import collections
+import itertools
 import threading
 
 DEFAULT_CONFIG = {
     'base_name': 'bot_',
     'permission': 0,
-    'interval': 1.0
+    'interval': 1.0,
+    'workers': 4,
+    'join_poll_interval': 3.0,
+    'init_window': 1,
+    'max_online_bots': 0,
+    'max_command_rate': 0,
+    'log_level': 'info',
+    'trace_size': 2000,
+    'roster_sync_interval': 60.0,
+    'skip_offline_bots': False,
+    'repeat_jitter': 0.5,
+    'use_rcon': False,
+    'adaptive_interval': {
+        'enabled': False,
+        'target_mspt': 40.0,
+        'bound': 'ceiling',
+        'min_interval': 0.05,
+        'max_interval': 5.0,
+        'sample_period': 5.0,
+        'health_command': 'tick health'
+    },
+    'stats_dump': {
+        'interval': 0,
+        'format': 'json'
+    },
+    'chunk_order': {
+        'enabled': True,
+        'forceload': False,
+        'max_forceload_chunks': 64
+    },
+    'occupancy': {
+        'enabled': True,
+        'policy': 'refuse',
+        'cell_size': 1.0,
+        'max_shift': 64
+    },
+    'journal': {
+        'enabled': True,
+        'flush_interval': 2.0
+    },
+    'bulk_dispatch': {
+        'enabled': False,
+        'world': 'world',
+        'min_batch': 16,
+        'chunk_size': 1000,
+        'reload_delay': 2.0,
+        'pack_format': 48,
+        'cache_size': 16
+    }
 }
 
+DATAPACK_NAME = 'player_batch'
+FUNCTION_FILE_PATTERN = re.compile(r'batch_([0-9a-f]+)_(?:\d+|probe)\.mcfunction')
+# 控制台中探测函数的反馈：已加载时为 Executed ... from function，不存在时为 Unknown function
+PROBE_OUTPUT_PATTERN = re.compile(rf'{DATAPACK_NAME}:batch_[0-9a-f]+_probe')
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+COLOR_CODE_PATTERN = re.compile('§.')
+SPAWN_COMMAND_PATTERN = re.compile(r'player (\S+) spawn')
+KILL_COMMAND_PATTERN = re.compile(r'player (\S+) kill')
+# Carpet /player 的错误反馈：带假人名称的，以及无法直接对应到假人的
+CARPET_NAMED_ERROR_PATTERN = re.compile(
+    r"Player (\w+) (is already logged on|is banned on this server|doesn't exist and cannot spawn.*"
+    r"|is not a fake player|cannot .+|can't .+)")
+CARPET_GENERIC_ERROR_PATTERN = re.compile(
+    r"(Player names can only be .+|Only ops can .+|Only fake players can .+|.*cannot (?:be )?spawn.*)")
+# 原版的命令错误，任何控制台命令都可能产生，只用于 RCON 返回的单条命令结果
+COMMAND_ERROR_PATTERN = re.compile(r"(Unknown or incomplete command.*|Incorrect argument for command.*)")
+
+
+def carpet_error(text: str, command_result: bool = False):
+    """从 /player 命令的反馈中识别错误，返回 (假人名称或 None, 原因)，不是错误时返回 None
+
+    command_result 为 True 表示 text 是这条命令自己的执行结果（RCON），此时原版的命令错误也算作生成失败。
+    """
+    match = CARPET_NAMED_ERROR_PATTERN.search(text)
+    if match is not None:
+        return match.group(1), match.group(2)
+    match = CARPET_GENERIC_ERROR_PATTERN.search(text)
+    if match is None and command_result:
+        match = COMMAND_ERROR_PATTERN.search(text)
+    if match is not None:
+        return None, match.group(1)
+    return None
+
+def function_loaded(text: str) -> bool:
+    """/function 命令的反馈是否表示函数已加载"""
+    return 'Unknown function' not in text and COMMAND_ERROR_PATTERN.search(text) is None
+
+# 不带名称的错误只归到这段时间内发出的生成命令
+SPAWN_ERROR_WINDOW = 5.0
+# 假人动作按游戏刻合并发送
+ACTION_TICK = 0.05
+# 占用在线名额但这段时间后仍不在线的假人视为未能加入，释放名额
+BOT_SLOT_EXPIRY = 30.0
+# 等待控制台中探测函数反馈的时间，以及数据包未加载时的探测次数（每次间隔 reload_delay）
+FUNCTION_CONFIRM_TIMEOUT = 5.0
+FUNCTION_PROBE_ATTEMPTS = 3
+
+# MinecraftDataAPI 在旧版本中以数字表示维度
+LEGACY_DIMENSIONS = {'0': 'minecraft:overworld', '-1': 'minecraft:the_nether', '1': 'minecraft:the_end'}
+
+# Carpet 的 /tick health（/profile health）与原版 /tick query 输出中的平均每刻耗时
+MSPT_PATTERN = re.compile(r'(?:average tick time|average time per tick|mspt)\s*[:=]?\s*([\d.]+)\s*ms', re.IGNORECASE)
+
+
+class PluginLog:
+    """分级日志
+
+    低于配置级别的消息不会被格式化和输出。所有消息连同每个假人的详细过程（trace）以未格式化的
+    形式写入固定大小的环形缓冲区，需要排查时通过 !!plb trace dump 导出到文件。
+    消息使用 % 风格的延迟格式化参数。
+    """
+
+    def __init__(self, logger, level: str = 'info', trace_size: int = 2000):
+        self.logger = logger
+        self.level = LOG_LEVELS[level]
+        self.buffer = collections.deque(maxlen=trace_size)
+
+    def configure(self, level: str, trace_size: int):
+        self.level = LOG_LEVELS[level]
+        if trace_size != self.buffer.maxlen:
+            self.buffer = collections.deque(self.buffer, maxlen=trace_size)
+
+    def trace(self, msg: str, *args):
+        self.buffer.append((time.time(), 'TRACE', msg, args))
+
+    def _log(self, level_name: str, emit, msg: str, args: tuple, prefix: str = ''):
+        self.buffer.append((time.time(), level_name, msg, args))
+        if LOG_LEVELS[level_name.lower()] >= self.level:
+            emit(prefix + (msg % args if args else msg))
+
+    def debug(self, msg: str, *args):
+        self._log('DEBUG', self.logger.info, msg, args, '§7[DEBUG] ')
+
+    def info(self, msg: str, *args):
+        self._log('INFO', self.logger.info, msg, args)
+
+    def warning(self, msg: str, *args):
+        self._log('WARNING', self.logger.warning, msg, args)
+
+    def error(self, msg: str, *args):
+        self._log('ERROR', self.logger.error, msg, args)
+
+    def dump(self, path: str) -> int:
+        """把缓冲区写入文件，返回写入的条数"""
+        entries = list(self.buffer)
+        with open(path, 'w', encoding='utf8') as f:
+            for timestamp, level_name, msg, args in entries:
+                try:
+                    text = msg % args if args else msg
+                except (TypeError, ValueError):
+                    text = f'{msg} {args}'
+                clock = time.strftime('%H:%M:%S', time.localtime(timestamp))
+                f.write(f'{clock}.{int(timestamp * 1000) % 1000:03d} [{level_name}] {COLOR_CODE_PATTERN.sub("", text)}\n')
+        return len(entries)
+
+
+class ScheduledTask:
+    """调度器中的一个延时任务，可在执行前取消"""
+
+    __slots__ = ('deadline', 'func', 'args', 'cancelled')
+
+    def __init__(self, deadline: float, func, args: tuple):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """共享调度器：按截止时间排序的优先队列 + 固定数量的工作线程
+
+    所有延时操作（命令间隔、动作延迟、加入超时）都作为任务提交到这里，
+    线程数量不随假人或任务数量增长。任务回调应尽快返回，需要等待时重新提交后续任务。
+    """
+
+    def __init__(self, logger, workers: int = 4):
+        self.logger = logger
+        self.workers = workers
+        self._queue = []  # [(deadline, seq, ScheduledTask)]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'PlayerBatch-Worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+        self._threads.clear()
+
+    def call_later(self, delay: float, func, *args) -> ScheduledTask:
+        """提交延时任务，调度器关闭后提交的任务直接丢弃"""
+        task = ScheduledTask(time.monotonic() + max(delay, 0), func, args)
+        with self._cond:
+            if not self._running:
+                task.cancel()
+                return task
+            heapq.heappush(self._queue, (task.deadline, next(self._seq), task))
+            self._cond.notify()
+        return task
+
+    def call_soon(self, func, *args) -> ScheduledTask:
+        return self.call_later(0, func, *args)
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def alive_workers(self) -> int:
+        return sum(1 for thread in self._threads if thread.is_alive())
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    remaining = self._queue[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        task = heapq.heappop(self._queue)[2]
+                        break
+                    self._cond.wait(remaining)
+
+            if task.cancelled:
+                continue
+            try:
+                task.func(*task.args)
+            except Exception as e:
+                self.logger.error(f'§c调度任务执行出错: {e}')
+
+
+class FairDispatcher:
+    """在所有任务之间分配命令发送名额
+
+    每个任务每次只排队一个步骤，执行后再排到队尾，同一优先级的任务因此轮流发送；
+    优先级高的任务总是先于优先级低的任务。每个调度任务只执行一个步骤，之后重新提交，
+    调度器关闭（插件卸载）后队列中的步骤不再执行。rate 大于 0 时插件发出的所有命令共享每秒 rate 个名额：
+    每条命令通过 charge() 占用名额（包括不经过队列直接发送的动作、退出和 forceload 等命令），
+    名额用完后队列中的步骤等到下一个名额再执行。
+    """
+
+    def __init__(self, logger, scheduler: Scheduler, rate: float = 0):
+        self.logger = logger
+        self.scheduler = scheduler
+        self.rate = rate
+        self.lock = threading.Lock()
+        self._queues = {}  # {priority: deque([(job, func, args)])}
+        self._pumping = False
+        self._next_slot = 0.0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def charge(self, count: int = 1):
+        """发送了 count 条命令，推迟下一个名额"""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self._next_slot = max(self._next_slot, time.monotonic()) + count / self.rate
+
+    def submit(self, job: 'Job', func, *args):
+        with self.lock:
+            self._queues.setdefault(job.priority, collections.deque()).append((job, func, args))
+            if self._pumping:
+                return
+            self._pumping = True
+        self.scheduler.call_later(self._next_slot - time.monotonic(), self._pump)
+
+    def _pop(self):
+        with self.lock:
+            for priority in sorted(self._queues, reverse=True):
+                if self._queues[priority]:
+                    return self._queues[priority].popleft()
+            self._pumping = False
+            return None
+
+    def _pump(self):
+        if self.rate > 0:
+            delay = self._next_slot - time.monotonic()
+            if delay > 0:
+                self.scheduler.call_later(delay, self._pump)
+                return
+        entry = self._pop()
+        if entry is None:
+            return
+        job, func, args = entry
+        if job.state == 'paused':
+            job.later(0, self.submit, job, func, *args)  # 恢复后重新排队
+        elif job.state == 'running':
+            try:
+                func(*args)
+            except Exception as e:
+                self.logger.error('§c任务 #%d 的步骤执行出错: %s', job.id, e)
+        self.scheduler.call_soon(self._pump)
+
+
+class Histogram:
+    """固定桶的延迟直方图（毫秒），百分位取所在桶的上界"""
+
+    BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf'))
+
+    def __init__(self):
+        self.buckets = [0] * len(self.BOUNDS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for idx, bound in enumerate(self.BOUNDS):
+            if value <= bound:
+                self.buckets[idx] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction: float):
+        if self.count == 0:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for idx, bound in enumerate(self.BOUNDS):
+            seen += self.buckets[idx]
+            if seen >= target:
+                return round(min(bound, self.max), 2)
+        return round(self.max, 2)
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 2) if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'max': round(self.max, 2)
+        }
+
+
+class Metrics:
+    """插件热路径上的计数器与延迟直方图"""
+
+    RATE_WINDOW = 10  # 分发速率的统计窗口（秒）
+    COUNTERS = ('commands_dispatched', 'rcon_commands', 'spawn_failures', 'action_timeouts', 'join_timeouts')
+    HISTOGRAMS = ('spawn_to_join_ms', 'join_to_action_ms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self._per_second = {}  # {整数秒: 分发命令数}
+
+    def incr(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def record_dispatch(self):
+        second = int(time.monotonic())
+        with self.lock:
+            self.counters['commands_dispatched'] = self.counters.get('commands_dispatched', 0) + 1
+            self._per_second[second] = self._per_second.get(second, 0) + 1
+            if len(self._per_second) > self.RATE_WINDOW * 2:
+                for key in [key for key in self._per_second if key <= second - self.RATE_WINDOW]:
+                    del self._per_second[key]
+
+    def dispatch_rate(self) -> float:
+        now = int(time.monotonic())
+        with self.lock:
+            recent = sum(count for second, count in self._per_second.items() if now - self.RATE_WINDOW < second <= now)
+        return recent / self.RATE_WINDOW
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+        return {
+            'time': round(time.time(), 3),
+            'uptime': round(time.time() - self.started, 1),
+            'dispatch_rate': round(self.dispatch_rate(), 2),
+            'counters': counters,
+            'histograms': histograms
+        }
+
+
+class AdaptiveRateController:
+    """根据服务器 MSPT 调整命令间隔
+
+    MSPT 高于目标时成倍放慢，明显低于目标时逐步加快（AIMD），间隔始终限制在 [lower, upper] 内。
+    """
+
+    def __init__(self, interval: float, target_mspt: float, lower: float, upper: float,
+                 slow_down: float = 1.5, speed_up: float = 0.8):
+        self.target_mspt = target_mspt
+        self.lower = lower
+        self.upper = max(lower, upper)
+        self.slow_down = slow_down
+        self.speed_up = speed_up
+        self.interval = min(max(interval, self.lower), self.upper)
+        self.last_mspt = None
+        self.lock = threading.Lock()
+
+    def observe(self, mspt: float) -> float:
+        with self.lock:
+            self.last_mspt = mspt
+            if mspt > self.target_mspt:
+                self.interval = min(self.upper, max(self.interval, 0.05) * self.slow_down)
+            elif mspt < self.target_mspt * 0.8:
+                self.interval = max(self.lower, self.interval * self.speed_up)
+            return self.interval
+
+
+class BatchSpec:
+    """批量任务的紧凑描述
+
+    只保存名称前缀、序号范围、动作、执行者和阵列几何信息，命令在分发时由生成器逐条产生，
+    内存占用与批量大小无关。
+    """
+
+    def __init__(self, name_prefix: str, start: int, end: int, action: str,
+                 executor: str = None, formation: dict = None, only: list = None, skip: int = 0):
+        self.name_prefix = name_prefix
+        self.start = start
+        self.end = end
+        self.action = action
+        self.executor = executor  # 玩家执行时的玩家名，控制台为 None
+        self.formation = formation  # None / 直线 / 方阵参数，order 为 chunk 时按区块分组执行
+        self.only = only  # 只操作范围内的这些序号（如在线的假人），None 表示全部
+        self.skip = skip  # 跳过执行顺序中前 skip 个已完成的假人（恢复中断的任务）
+
+    def __len__(self):
+        count = len(self.only) if self.only is not None else self.end - self.start + 1
+        return max(count - self.skip, 0)
+
+    @property
+    def spawns(self) -> bool:
+        return self.action.strip().lower().startswith('spawn')
+
+    def bot_name(self, i: int) -> str:
+        return f'{self.name_prefix}{i}'
+
+    def offset(self, i: int):
+        """第 i 个假人相对执行位置的 (x, z) 偏移"""
+        formation = self.formation
+        idx = i - self.start
+        if formation['type'] == 'line':
+            offset = idx * formation['spacing'] * formation['sign']
+            x_offset, z_offset = (offset, 0) if formation['axis'] == 'x' else (0, offset)
+        else:
+            x_offset = 0.0
+            z_offset = 0.0
+            row = idx // formation['width']
+            col = idx % formation['width']
+            for axis, sign, step in ((formation['axis1'], formation['sign1'], row),
+                                     (formation['axis2'], formation['sign2'], col)):
+                if axis == 'x':
+                    x_offset += step * formation['spacing'] * sign
+                elif axis == 'z':
+                    z_offset += step * formation['spacing'] * sign
+        # 与已有假人重叠时整体平移阵列
+        shift_x, shift_z = formation.get('shift') or (0, 0)
+        return x_offset + shift_x, z_offset + shift_z
+
+    def position(self, i: int):
+        """第 i 个假人的绝对 (x, z) 坐标，执行位置未知时返回 None"""
+        origin = self.formation.get('origin')
+        if origin is None:
+            return None
+        x_offset, z_offset = self.offset(i)
+        return origin[0] + x_offset, origin[1] + z_offset
+
+    def coord(self, i: int) -> str:
+        x_offset, z_offset = self.offset(i)
+        if self.formation['type'] == 'line' and not self.formation.get('shift'):
+            if self.formation['axis'] == 'x':
+                return f'~{x_offset} ~ ~'
+            return f'~ ~ ~{z_offset}'
+        return f'~{x_offset} ~ ~{z_offset}'
+
+    def command(self, i: int) -> str:
+        bot_name = self.bot_name(i)
+        if self.formation is None:
+            if self.executor is not None:
+                return f'/execute as {self.executor} at @s run player {bot_name} {self.action}'
+            return f'/player {bot_name} {self.action}'
+
+        coord = self.coord(i)
+        if self.executor is not None:
+            return f'/execute as {self.executor} at @s positioned {coord} positioned over world_surface run player {bot_name} {self.action}'
+        return f'/execute positioned {coord} positioned over world_surface run player {bot_name} {self.action}'
+
+    def chunk_of(self, i: int):
+        """第 i 个假人所在的区块坐标，origin 未知时按执行位置为原点分组"""
+        x_offset, z_offset = self.offset(i)
+        origin_x, origin_z = self.formation.get('origin') or (0, 0)
+        return int((origin_x + x_offset) // 16), int((origin_z + z_offset) // 16)
+
+    def chunk_firsts(self) -> dict:
+        """按执行顺序，每个区块中第一个假人的序号 {区块: 序号}"""
+        firsts = {}
+        for i in self.indices():
+            firsts.setdefault(self.chunk_of(i), i)
+        return firsts
+
+    def _chunk_runs(self, count: int, axis: str, sign: int) -> list:
+        """方阵沿一个方向的 count 行（列）按所在区块切分成连续的段 [(起始, 结束)]，从第 0 行所在的区块开始"""
+        origin = self.formation.get('origin') or (0, 0)
+        shift = self.formation.get('shift') or (0, 0)
+        base = origin[0] + shift[0] if axis == 'x' else origin[1] + shift[1]
+        spacing = self.formation['spacing'] * sign
+        runs = []
+        chunk = None
+        for step in range(count):
+            current = (base + step * spacing) // 16
+            if current != chunk:
+                runs.append([step, step + 1])
+                chunk = current
+            else:
+                runs[-1][1] = step + 1
+        return runs
+
+    def _chunk_order(self):
+        """按区块分组的执行顺序，逐个生成而不保存整个顺序
+
+        直线上的假人本来就按区块连续排列；方阵的行和列分别按区块切分，以区块为单位从执行位置所在的
+        区块开始按行蛇形遍历，使已加载的区域保持紧凑，组内保持序号顺序。
+        """
+        formation = self.formation
+        only = set(self.only) if self.only is not None else None
+        if formation['type'] == 'line' or formation['axis1'] == formation['axis2']:
+            yield from (self.only if self.only is not None else range(self.start, self.end + 1))
+            return
+        width = formation['width']
+        rows = (self.end - self.start) // width + 1
+        col_runs = self._chunk_runs(width, formation['axis2'], formation['sign2'])
+        for n, (row_start, row_end) in enumerate(self._chunk_runs(rows, formation['axis1'], formation['sign1'])):
+            for col_start, col_end in (col_runs if n % 2 == 0 else reversed(col_runs)):
+                for row in range(row_start, row_end):
+                    for col in range(col_start, col_end):
+                        i = self.start + row * width + col
+                        if i <= self.end and (only is None or i in only):
+                            yield i
+
+    def indices(self):
+        """按执行顺序排列的假人序号"""
+        if self.formation is not None and self.formation.get('order') == 'chunk':
+            # 只改变执行顺序，名称与位置的对应关系不变
+            return itertools.islice(self._chunk_order(), self.skip, None)
+        if self.only is not None:
+            return self.only[self.skip:]
+        return range(self.start + self.skip, self.end + 1)
+
+    def commands(self):
+        for i in self.indices():
+            yield self.command(i)
+
+    def key(self) -> str:
+        """模板与范围的稳定标识，用于缓存生成的函数文件（不含 only 和 skip）"""
+        template = {key: value for key, value in self.to_dict().items() if key not in ('only', 'skip')}
+        raw = json.dumps(template, sort_keys=True)
+        return hashlib.sha1(raw.encode('utf8')).hexdigest()[:16]
+
+    def to_dict(self) -> dict:
+        return {
+            'name_prefix': self.name_prefix, 'start': self.start, 'end': self.end, 'action': self.action,
+            'executor': self.executor, 'formation': self.formation, 'only': self.only, 'skip': self.skip
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BatchSpec':
+        return cls(data['name_prefix'], data['start'], data['end'], data['action'], data.get('executor'),
+                   data.get('formation'), data.get('only'), data.get('skip', 0))
+
+
+class Job:
+    """注册表中的一个批量任务
+
+    任务的所有等待都通过 later() 提交到共享调度器：停止时立即取消全部等待中的步骤，
+    暂停时把到期的步骤挂起，恢复时重新提交。
+    """
+
+    def __init__(self, job_id: int, kind: str, description: str, total: int, owner: str,
+                 scheduler: Scheduler, on_end, priority: int = 0):
+        self.id = job_id
+        self.kind = kind
+        self.description = description
+        self.total = total
+        self.done = 0
+        self.failures = 0
+        self.checkpoint = None  # 按执行顺序连续完成的假人数量，写入任务日志
+        self.blocked = False  # 是否在等待在线名额
+        self.owner = owner
+        self.priority = priority  # 优先级高的任务先获得发送名额
+        self.period = None  # 重复任务的周期（秒），普通任务为 None
+        self.cycles = 0  # 重复任务已开始的轮数
+        self.forceloaded = []  # 强制加载的区块的释放命令
+        self.state = 'running'  # running / paused / stopped / finished / interrupted
+        self.scheduler = scheduler
+        self.on_end = on_end
+        self.stop_hooks = []
+        self.end_hooks = []  # 任务完成或停止后执行
+        self.lock = threading.Lock()
+        self._tasks = set()
+        self._parked = []
+        self._started = time.monotonic()
+        self._paused_at = None
+        self._paused_total = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.state in ('running', 'paused')
+
+    def later(self, delay: float, func, *args):
+        """延时执行任务的一个步骤，任务停止后不再执行"""
+        entry = [None]
+        with self.lock:
+            if not self.active:
+                return
+            entry[0] = self.scheduler.call_later(delay, self._run, entry, func, args)
+            self._tasks.add(entry[0])
+
+    def _run(self, entry: list, func, args: tuple):
+        with self.lock:
+            self._tasks.discard(entry[0])
+            if not self.active:
+                return
+            if self.state == 'paused':
+                self._parked.append((func, args))
+                return
+        func(*args)
+
+    def pause(self) -> bool:
+        with self.lock:
+            if self.state != 'running':
+                return False
+            self.state = 'paused'
+            self._paused_at = time.monotonic()
+        return True
+
+    def resume(self) -> bool:
+        with self.lock:
+            if self.state != 'paused':
+                return False
+            self.state = 'running'
+            self._paused_total += time.monotonic() - self._paused_at
+            self._paused_at = None
+            parked, self._parked = self._parked, []
+        for func, args in parked:
+            self.later(0, func, *args)
+        return True
+
+    def stop(self) -> bool:
+        with self.lock:
+            if not self.active:
+                return False
+            self.state = 'stopped'
+            for task in self._tasks:
+                task.cancel()
+            self._tasks.clear()
+            self._parked.clear()
+        for hook in self.stop_hooks + self.end_hooks:
+            hook()
+        self.on_end(self)
+        return True
+
+    def interrupt(self) -> bool:
+        """插件卸载时中止任务：取消等待中的步骤，不执行结束回调，任务日志中不写结束记录，重新加载后可以恢复"""
+        with self.lock:
+            if not self.active:
+                return False
+            self.state = 'interrupted'
+            for task in self._tasks:
+                task.cancel()
+            self._tasks.clear()
+            self._parked.clear()
+        return True
+
+    def finish(self):
+        with self.lock:
+            if not self.active:
+                return
+            self.state = 'finished'
+        for hook in self.end_hooks:
+            hook()
+        self.on_end(self)
+
+    def elapsed(self) -> float:
+        paused = self._paused_total
+        if self._paused_at is not None:
+            paused += time.monotonic() - self._paused_at
+        return time.monotonic() - self._started - paused
+
+    def eta(self):
+        if self.done <= 0 or self.total <= 0:
+            return None
+        return self.elapsed() / self.done * max(self.total - self.done, 0)
+
+    def status_text(self) -> str:
+        percent = self.done * 100 // self.total if self.total > 0 else 0
+        eta = self.eta()
+        eta_text = f'{eta:.1f}秒' if eta is not None else '未知'
+        state = {'running': '§a运行中', 'paused': '§e已暂停'}.get(self.state, self.state)
+        if self.blocked and self.state == 'running':
+            state = '§c等待在线名额'
+        timing = f'§7剩余约 §e{eta_text}'
+        if self.period is not None:
+            timing = f'§7每 §e{self.period / 60:g} §7分钟，第 §e{self.cycles} §7轮'
+        return (f'§6#{self.id} §7[{self.kind}] §f{self.description} §7进度 §e{self.done}/{self.total} ({percent}%) '
+                f'{state} {timing} §7发起者 {self.owner} §7优先级 {self.priority}')
+
+
+class JobJournal:
+    """只追加的任务日志
+
+    记录每个任务的参数和按执行顺序连续完成的假人数量。写入先缓存在内存中，由定时任务批量写入并 fsync，
+    分发命令时不访问磁盘。插件重载或服务端重启后，没有结束记录的任务可以从下一个假人继续。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.interrupted = {}  # {job_id: 上次运行中断的任务的启动记录（含 last）}
+        self._buffer = []
+        self._checkpoints = {}  # {job_id: 已写入的完成数量}
+
+    def load(self) -> int:
+        """读取日志中未结束的任务并压缩日志文件，返回日志中最大的任务ID"""
+        records = {}
+        max_id = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 写入中途被打断的行
+                    job_id = entry.get('id')
+                    if not isinstance(job_id, int):
+                        continue
+                    max_id = max(max_id, job_id)
+                    if entry.get('op') == 'start':
+                        records[job_id] = entry
+                    elif entry.get('op') == 'progress' and job_id in records:
+                        records[job_id]['done'] = entry['done']
+                    elif entry.get('op') == 'forceload' and job_id in records:
+                        records[job_id]['forceload'] = entry['release']
+                    elif entry.get('op') == 'end':
+                        records.pop(job_id, None)
+        with self.lock:
+            self.interrupted = records
+            self._write(list(records.values()), 'w')
+        return max_id
+
+    def start(self, job: 'Job', record: dict):
+        entry = {'op': 'start', 'id': job.id, 'kind': job.kind, 'description': job.description,
+                 'owner': job.owner, 'time': time.time(), **record}
+        with self.lock:
+            self._buffer.append(entry)
+            self._checkpoints[job.id] = None
+
+    def forceload(self, job_id: int, release: list):
+        """记录任务强制加载的区块的释放命令，空列表表示已经释放"""
+        with self.lock:
+            if job_id in self._checkpoints:
+                self._buffer.append({'op': 'forceload', 'id': job_id, 'release': release})
+
+    def end(self, job_id: int, state: str):
+        with self.lock:
+            if job_id not in self._checkpoints and job_id not in self.interrupted:
+                return
+            self._checkpoints.pop(job_id, None)
+            self.interrupted.pop(job_id, None)
+            self._buffer.append({'op': 'end', 'id': job_id, 'state': state})
+
+    def flush(self, jobs):
+        """写入缓存的记录和各任务进度的变化"""
+        with self.lock:
+            for job in jobs:
+                if job.id in self._checkpoints and job.checkpoint is not None \
+                        and job.checkpoint != self._checkpoints[job.id]:
+                    self._checkpoints[job.id] = job.checkpoint
+                    self._buffer.append({'op': 'progress', 'id': job.id, 'done': job.checkpoint})
+            if not self._buffer:
+                return
+            entries, self._buffer = self._buffer, []
+            self._write(entries, 'a')
+
+    def _write(self, entries: list, mode: str):
+        target = self.path if mode == 'a' else self.path + '.tmp'
+        with open(target, mode, encoding='utf8') as f:
+            f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        if target != self.path:
+            os.replace(target, self.path)
+
+
+class OnlineRoster:
+    """插件自己维护的在线玩家索引
+
+    由加入/离开事件增量更新，并定期用完整的 list 结果对账，在线判断都是集合查找。
+    """
+
+    def __init__(self):
+        self.players = set()
+        self.synced = False  # 是否至少与服务端对账过一次
+        self.last_sync = 0.0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.players)
+
+    def add(self, player: str):
+        with self.lock:
+            self.players.add(player)
+
+    def discard(self, player: str):
+        with self.lock:
+            self.players.discard(player)
+
+    def reconcile(self, players):
+        with self.lock:
+            self.players = set(players)
+            self.synced = True
+            self.last_sync = time.monotonic()
+
+    def is_online(self, player: str) -> bool:
+        return player in self.players
+
+    def online_among(self, names) -> list:
+        players = self.players
+        return [name for name in names if name in players]
+
+    def select(self, prefix: str, start: int, end: int) -> list:
+        """返回 prefix + 序号 在线的序号列表（升序）"""
+        with self.lock:
+            players = self.players
+            if end - start + 1 <= len(players):
+                return [i for i in range(start, end + 1) if f'{prefix}{i}' in players]
+            result = []
+            for player in players:
+                suffix = player[len(prefix):]
+                if player.startswith(prefix) and suffix.isdigit() and str(int(suffix)) == suffix:
+                    if start <= int(suffix) <= end:
+                        result.append(int(suffix))
+        return sorted(result)
+
+
+class OccupancyIndex:
+    """插件生成的假人位置的空间哈希
+
+    按 (维度, 格子x, 格子z) 分桶记录格子中的假人，生成时加入、退出时移除。两个假人在 X 和 Z 方向的距离都小于
+    一个格子时视为重叠，因此查询一个位置只需检查周围 3×3 个格子。另按区块大小的区域记录各区域中的假人数量，
+    判断一个范围内是否有假人时只查这些区域，耗时与记录的假人总数无关。
+    阵列都生成在地表（positioned over world_surface），因此只按 XZ 平面划分格子。
+    """
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.region_size = max(cell_size, 16.0)
+        self.cells = {}  # {格子: {bot_name}}
+        self.regions = {}  # {(维度, 区域x, 区域z): 假人数量}
+        self.bots = {}  # {bot_name: (维度, x, z)}
+        self.added = {}  # {bot_name: 记录的时间}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.bots)
+
+    def cell(self, dimension, x: float, z: float) -> tuple:
+        return dimension, math.floor(x / self.cell_size), math.floor(z / self.cell_size)
+
+    def region(self, dimension, x: float, z: float) -> tuple:
+        return dimension, math.floor(x / self.region_size), math.floor(z / self.region_size)
+
+    def add(self, bot_name: str, dimension, x: float, z: float):
+        cell = self.cell(dimension, x, z)
+        region = self.region(dimension, x, z)
+        with self.lock:
+            self._remove(bot_name)
+            self.cells.setdefault(cell, set()).add(bot_name)
+            self.regions[region] = self.regions.get(region, 0) + 1
+            self.bots[bot_name] = (dimension, x, z)
+            self.added[bot_name] = time.monotonic()
+
+    def remove(self, bot_name: str):
+        with self.lock:
+            self._remove(bot_name)
+
+    def prune(self, is_online, min_age: float) -> list:
+        """移除已记录超过 min_age 秒且不在线的假人（退出事件丢失或被其他方式移除），返回移除的假人"""
+        now = time.monotonic()
+        with self.lock:
+            stale = [bot_name for bot_name, added in self.added.items()
+                     if now - added > min_age and not is_online(bot_name)]
+            for bot_name in stale:
+                self._remove(bot_name)
+        return stale
+
+    def any_within(self, dimension, min_x: float, min_z: float, max_x: float, max_z: float) -> bool:
+        """矩形范围（向外扩展一个格子）内是否可能有重叠的假人，用于在逐个检查前快速排除不相交的阵列
+
+        遍历范围覆盖的区域与有假人的区域中较少的一方。
+        """
+        margin = self.cell_size
+        _, min_rx, min_rz = self.region(dimension, min_x - margin, min_z - margin)
+        _, max_rx, max_rz = self.region(dimension, max_x + margin, max_z + margin)
+        with self.lock:
+            if (max_rx - min_rx + 1) * (max_rz - min_rz + 1) <= len(self.regions):
+                return any((dimension, rx, rz) in self.regions
+                           for rx in range(min_rx, max_rx + 1) for rz in range(min_rz, max_rz + 1))
+            return any(region[0] == dimension and min_rx <= region[1] <= max_rx and min_rz <= region[2] <= max_rz
+                       for region in self.regions)
+
+    def _remove(self, bot_name: str):
+        self.added.pop(bot_name, None)
+        position = self.bots.pop(bot_name, None)
+        if position is None:
+            return
+        cell = self.cell(*position)
+        occupants = self.cells[cell]
+        occupants.discard(bot_name)
+        if not occupants:
+            del self.cells[cell]
+        region = self.region(*position)
+        self.regions[region] -= 1
+        if not self.regions[region]:
+            del self.regions[region]
+
+    def occupant(self, bot_name: str, dimension, x: float, z: float):
+        """与位置重叠（X、Z 方向的距离都小于一个格子）的除 bot_name 以外的一个假人，没有时返回 None
+
+        执行位置不在整数坐标上时，重叠的假人可能记录在相邻的格子中，因此检查周围的 3×3 个格子。
+        """
+        _, cell_x, cell_z = self.cell(dimension, x, z)
+        with self.lock:
+            for dx in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    for other in self.cells.get((dimension, cell_x + dx, cell_z + dz), ()):
+                        if other == bot_name:
+                            continue
+                        _, other_x, other_z = self.bots[other]
+                        if abs(other_x - x) < self.cell_size and abs(other_z - z) < self.cell_size:
+                            return other
+        return None
+
+
+class BotRecord:
+    """一个假人的动作状态：pending → joined → acting → done，或 timeout / failed / stopped"""
+
+    __slots__ = ('bot_name', 'actions', 'on_done', 'state')
+
+    def __init__(self, bot_name: str, actions: list, on_done):
+        self.bot_name = bot_name
+        self.actions = actions
+        self.on_done = on_done
+        self.state = 'pending'
+
+
+class BotStateStore:
+    """假人动作状态的并发存储
+
+    每次状态转换都在锁内检查当前状态和记录是否仍是该假人的最新记录，加入、超时、生成失败和停止之间
+    的竞争由先到者决定，后到者得到 None，因此每条记录的完成回调只会被取出一次。进入终态的记录立即移除。
+    锁内只做字典操作，命令分发和回调都在锁外执行。
+    """
+
+    TERMINAL = ('done', 'timeout', 'failed', 'stopped')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._records = {}  # {bot_name: BotRecord}
+
+    def __len__(self):
+        return len(self._records)
+
+    def count(self, state: str) -> int:
+        with self.lock:
+            return sum(1 for record in self._records.values() if record.state == state)
+
+    def add(self, bot_name: str, actions: list, on_done=None):
+        """登记新的待加入假人，返回 (新记录, 被替换的旧记录或 None)"""
+        record = BotRecord(bot_name, actions, on_done)
+        with self.lock:
+            previous = self._records.get(bot_name)
+            if previous is not None:
+                previous.state = 'stopped'
+            self._records[bot_name] = record
+        return record, previous
+
+    def transition(self, bot_name: str, expected: tuple, state: str, record: BotRecord = None):
+        """当前状态属于 expected 时转换到 state 并返回记录，否则返回 None；指定 record 时还要求它仍是最新记录"""
+        with self.lock:
+            current = self._records.get(bot_name)
+            if current is None or current.state not in expected or (record is not None and current is not record):
+                return None
+            current.state = state
+            if state in self.TERMINAL:
+                del self._records[bot_name]
+            return current
+
+    def is_current(self, record: BotRecord) -> bool:
+        with self.lock:
+            return self._records.get(record.bot_name) is record
+
+    def discard(self, bot_name: str):
+        with self.lock:
+            record = self._records.pop(bot_name, None)
+            if record is not None:
+                record.state = 'stopped'
+        return record
+
+    def clear(self) -> list:
+        """停止所有记录并返回它们"""
+        with self.lock:
+            records = list(self._records.values())
+            self._records.clear()
+            for record in records:
+                record.state = 'stopped'
+        return records
+
+
+class JoinWaiter:
+    """等待某个假人加入游戏的回调，只会被完成一次"""
+
+    __slots__ = ('bot_name', 'callback', 'done')
+
+    def __init__(self, bot_name: str, callback):
+        self.bot_name = bot_name
+        self.callback = callback
+        self.done = False
+
 
 class PlayerBatch:
     def __init__(self, server: PluginServerInterface):
         self.server = server
         self.config = None
+        self.log = PluginLog(server.logger)
         self.config_file = os.path.join(server.get_data_folder(), 'player_batch.json')
-        # 新增：假人动作队列
-        self.pending_actions = {}  # {bot_name: [action_commands]}
-        self.processing_bots = set()  # 正在处理的假人
-        # 新增：全局停止标志
-        self.stop_cmd = False
+        # 假人动作状态（pending → joined → acting → done / timeout）
+        self.bot_states = BotStateStore()
+        # 按刻合并的动作桶 {刻序号: [[BotRecord, idx, joined_at]]}，每个桶只占用一次调度
+        self.action_buckets = {}
+        self.bucket_lock = threading.Lock()
+        # 任务注册表 {job_id: Job}
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.jobs_lock = threading.Lock()
+        # 任务日志（未启用时为 None）
+        self.journal = None
+        # 等待假人加入的任务 {bot_name: [JoinWaiter]}
+        self.join_waiters = {}
+        self.waiter_lock = threading.Lock()
+        # 在线玩家索引，同一时间只进行一次 list 查询
+        self.roster = OnlineRoster()
+        self.roster_query_lock = threading.Lock()
+        # 在线名额：插件生成且尚未退出的假人 {bot_name: 占用名额的时间}，以及等待名额的任务
+        self.active_bots = {}
+        self.blocked_spawns = collections.deque()  # [(job, bot_name, resume)]
+        self.budget_lock = threading.Lock()
+        # 运行指标
+        self.metrics = Metrics()
+        self.spawn_times = {}  # {bot_name: 生成命令发出的时间}
+        self.last_spawn_command = None  # 最近发出的命令是生成命令时为该假人名称
+        # 共享调度器，在加载配置后启动
+        self.scheduler = None
+        # 各任务共享的命令发送名额
+        self.dispatcher = None
+        # 自适应命令间隔（未启用时为 None）
+        self.rate_controller = None
+        # 阵列假人的位置索引，在加载配置后创建
+        self.occupancy = None
+        # 正在执行的批量函数 {key: 任务数}，清理缓存时保留
+        self.bulk_keys = collections.Counter()
+        # 等待控制台反馈的探测函数 {函数名: 回调}
+        self.function_probes = {}
+        self.last_health_request = 0.0
 
     def on_load(self):
         self.load_config()
+        self.log.configure(self.config['log_level'], self.config['trace_size'])
+        self.scheduler = Scheduler(self.log, self.config['workers'])
+        self.scheduler.start()
+        self.dispatcher = FairDispatcher(self.log, self.scheduler, self.config['max_command_rate'])
+        self.occupancy = OccupancyIndex(self.config['occupancy']['cell_size'])
+        self.setup_rate_controller()
+        self.scheduler.call_soon(self.__periodic_roster_sync)
+        self.setup_journal()
+        if self.config['stats_dump']['interval'] > 0:
+            self.scheduler.call_later(self.config['stats_dump']['interval'], self.__periodic_stats_dump)
         self.register_commands()
-        self.server.logger.info('§a插件初始化完成')
-
-    def on_bot_joined(self, player_name: str):
-        """当假人加入游戏时调用"""
-        # 调试信息
-        self.server.logger.info(f'§6[DEBUG] === 进入on_bot_joined方法 ===')
-        self.server.logger.info(f'§6[DEBUG] 加入的玩家: {player_name}')
-        self.server.logger.info(f'§6[DEBUG] 当前等待队列: {list(self.pending_actions.keys())}')
-        self.server.logger.info(f'§6[DEBUG] 正在处理的假人: {self.processing_bots}')
-
-        # 检查是否是我们要处理的假人
-        for bot_name in list(self.pending_actions.keys()):
-            self.server.logger.info(f'§6[DEBUG] 比较: "{player_name}" == "{bot_name}" -> {player_name == bot_name}')
-            if player_name == bot_name:
-                self.server.logger.info(f'§a[SUCCESS] 匹配成功！检测到假人 {player_name} 加入游戏，开始执行动作')
-
-                def execute_actions():
-                    time.sleep(0.2)  # 额外等待0.2秒确保稳定
-                    if bot_name in self.pending_actions:
-                        actions = self.pending_actions[bot_name]
-                        self.server.logger.info(f'§a[SUCCESS] 开始执行假人 {bot_name} 的 {len(actions)} 个动作')
-
-                        for action in actions:
-                            try:
-                                self.server.logger.info(f'§a执行假人 {bot_name} 动作: {action}')
-                                self.server.execute(action)
-                                time.sleep(0.1)  # 动作间小间隔
-                            except Exception as e:
-                                self.server.logger.error(f'§c执行假人 {bot_name} 动作失败: {e}')
-
-                        # 清理队列
-                        del self.pending_actions[bot_name]
-                        self.processing_bots.discard(bot_name)
-                        self.server.logger.info(f'§a假人 {bot_name} 动作执行完成')
-                    else:
-                        self.server.logger.warning(f'§e假人 {bot_name} 不在等待队列中，可能已超时清理')
-
-                threading.Thread(target=execute_actions, daemon=True).start()
-                break  # 找到匹配的假人就退出循环
+        self.log.info('§a插件初始化完成')
+
+    def on_unload(self):
+        # 中止正在执行的任务并关闭调度器，再写入任务日志；中止的任务不写结束记录，下次加载时可以恢复
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.interrupt()
+            # 强制加载的区块在卸载时释放；服务端已停止时保留日志中的记录，恢复或丢弃任务时释放
+            if job.forceloaded and self.server.is_server_running():
+                self.release_forceload(job)
+                if self.journal is not None:
+                    self.journal.forceload(job.id, [])
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        self.flush_journal()
+
+    def setup_journal(self):
+        if not self.config['journal']['enabled']:
+            return
+        journal = JobJournal(os.path.join(self.server.get_data_folder(), 'player_batch_journal.jsonl'))
+        try:
+            max_id = journal.load()
+        except Exception as e:
+            self.log.error('§c读取任务日志失败: %s', e)
+            return
+        self.journal = journal
+        # 任务ID接着日志中的编号，避免与中断的任务重复
+        self.job_ids = itertools.count(max_id + 1)
+        if journal.interrupted:
+            self.log.info('§e发现 %d 个中断的任务，输入 §6!!plb recover §e查看并从下一个假人继续', len(journal.interrupted))
+        self.scheduler.call_later(self.config['journal']['flush_interval'], self.__periodic_journal_flush)
+
+    def flush_journal(self):
+        if self.journal is None:
+            return
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        try:
+            self.journal.flush(jobs)
+        except Exception as e:
+            self.log.error('§c写入任务日志失败: %s', e)
+
+    def __periodic_journal_flush(self):
+        self.flush_journal()
+        self.scheduler.call_later(self.config['journal']['flush_interval'], self.__periodic_journal_flush)
+
+    def journal_job(self, job: Job, spec: BatchSpec, reply_msg: str = None, use_interval: bool = True,
+                    init: dict = None):
+        """在任务日志中记录任务的参数，用于中断后恢复"""
+        if self.journal is not None:
+            self.journal.start(job, {'spec': spec.to_dict(), 'reply': reply_msg, 'use_interval': use_interval,
+                                     'init': init, 'period': job.period})
+
+    def setup_rate_controller(self):
+        adaptive = self.config['adaptive_interval']
+        if not adaptive['enabled']:
+            self.rate_controller = None
+            return
+        # 固定间隔只作为下限（floor，只会放慢）或上限（ceiling，空闲时加快、繁忙时最多放慢到固定间隔）
+        interval = self.config['interval']
+        if adaptive['bound'] == 'floor':
+            lower, upper = interval, adaptive['max_interval']
         else:
-            self.server.logger.info(f'§6[DEBUG] 玩家 {player_name} 不在等待队列中')
+            lower, upper = adaptive['min_interval'], interval
+        self.rate_controller = AdaptiveRateController(interval, adaptive['target_mspt'], lower, upper)
+
+    def on_info(self, info: Info):
+        """解析服务端输出中的 Carpet 错误反馈与 MSPT"""
+        if not info.is_from_server or info.player is not None:
+            return
+        if self.spawn_times:
+            self.check_spawn_error(info.content)
+        if self.function_probes:
+            self.check_function_probe(info.content)
+        self.check_mspt(info.content)
+
+    def check_mspt(self, text: str):
+        """从 tick 健康信息（控制台输出或 RCON 返回的结果）中解析 MSPT 并调整命令间隔"""
+        if self.rate_controller is None:
+            return
+        match = MSPT_PATTERN.search(text)
+        if match is not None:
+            try:
+                mspt = float(match.group(1))
+            except ValueError:
+                return
+            interval = self.rate_controller.observe(mspt)
+            self.log.debug('MSPT %.1f，命令间隔调整为 %.2f秒', mspt, interval)
+
+    def next_interval(self) -> float:
+        """当前的命令间隔，启用自适应时按采样周期请求一次 tick 健康信息"""
+        if self.rate_controller is None:
+            return self.config['interval']
+        adaptive = self.config['adaptive_interval']
+        now = time.monotonic()
+        if now - self.last_health_request >= adaptive['sample_period']:
+            self.last_health_request = now
+            self.dispatch(adaptive['health_command'])
+        return self.rate_controller.interval
+
+    def interval_text(self) -> str:
+        if self.rate_controller is None:
+            return f'{self.config["interval"]}秒'
+        return f'自适应 {self.rate_controller.interval:.2f}秒'
+
+    def dispatch(self, command: str, cost: int = 1):
+        """向服务端发送一条命令，所有命令都经过这里以便统计，并占用 cost 个全局发送名额
+
+        启用 use_rcon 且 RCON 可用时通过 MCDR 持久复用的 RCON 连接发送并返回执行结果，
+        生成失败会立即被识别；否则通过控制台发送并返回 None。
+        """
+        self.metrics.record_dispatch()
+        if self.dispatcher is not None:
+            self.dispatcher.charge(cost)
+        spawned = None
+        self.last_spawn_command = None
+        if 'spawn' in command:
+            match = SPAWN_COMMAND_PATTERN.search(command)
+            if match is not None:
+                spawned = match.group(1)
+                self.last_spawn_command = spawned
+                if len(self.spawn_times) > 10000:
+                    self.spawn_times.clear()
+                self.spawn_times[spawned] = time.monotonic()
+                with self.budget_lock:
+                    self.active_bots.setdefault(spawned, time.monotonic())
+        elif 'kill' in command:
+            match = KILL_COMMAND_PATTERN.search(command)
+            if match is not None:
+                self.release_bot(match.group(1))
+                self.occupancy.remove(match.group(1))
+
+        if self.config['use_rcon'] and self.server.is_rcon_running():
+            result = self.server.rcon_query(command.lstrip('/'))
+            if result is not None:
+                self.metrics.incr('rcon_commands')
+                error = carpet_error(result, command_result=True) if result else None
+                if spawned is not None and error is not None:
+                    self.on_spawn_failed(spawned, error[1])
+                # 通过 RCON 发送的命令的输出不会出现在控制台中，tick 健康信息在这里解析
+                if result:
+                    self.check_mspt(result)
+                return result
+        self.server.execute(command)
+        return None
+
+    def check_spawn_error(self, text: str):
+        """从控制台输出中识别 /player 生成失败，匹配到仍在等待加入的假人
+
+        带名称的错误直接对应假人；不带名称的错误只在最近发出的命令就是生成命令、且只有这一个假人
+        等待加入时才归到它，无法确定时忽略，由加入超时处理。
+        """
+        error = carpet_error(text)
+        if error is None:
+            return
+        bot_name, reason = error
+        if bot_name is None:
+            recent = [name for name, spawned_at in list(self.spawn_times.items())
+                      if time.monotonic() - spawned_at <= SPAWN_ERROR_WINDOW]
+            if len(recent) != 1 or recent[0] != self.last_spawn_command:
+                return
+            bot_name = recent[0]
+        elif bot_name not in self.spawn_times:
+            return
+        self.on_spawn_failed(bot_name, reason)
+
+    def on_spawn_failed(self, bot_name: str, reason: str):
+        """假人生成失败：立即以失败结束该假人的加入等待并丢弃它的动作"""
+        self.metrics.incr('spawn_failures')
+        self.spawn_times.pop(bot_name, None)
+        self.release_bot(bot_name)
+        self.occupancy.remove(bot_name)
+        self.log.trace('假人 %s 生成失败: %s', bot_name, reason)
+        with self.waiter_lock:
+            waiters = self.join_waiters.pop(bot_name, [])
+        for waiter in waiters:
+            self.__finish_waiter(waiter, False)
+        record = self.bot_states.transition(bot_name, ('pending',), 'failed')
+        if record is not None:
+            self.__notify_actions_done(record, False)
+
+    def stats_snapshot(self) -> dict:
+        snapshot = self.metrics.snapshot()
+        snapshot['gauges'] = {
+            'pending_actions': self.bot_states.count('pending'),
+            'action_buckets': len(self.action_buckets),
+            'join_waiters': len(self.join_waiters),
+            'active_bots': len(self.active_bots),
+            'blocked_spawns': len(self.blocked_spawns),
+            'jobs': len(self.jobs),
+            'scheduler_queue': self.scheduler.pending() if self.scheduler is not None else 0,
+            'dispatch_queue': len(self.dispatcher) if self.dispatcher is not None else 0,
+            'worker_threads': self.scheduler.alive_workers() if self.scheduler is not None else 0,
+            'process_threads': threading.active_count(),
+            'online_players': len(self.roster),
+            'tracked_positions': len(self.occupancy) if self.occupancy is not None else 0
+        }
+        return snapshot
 
-    def add_bot_action(self, bot_name: str, action_commands: list):
-        """添加假人动作到队列"""
-        self.server.logger.info(f'§6添加假人动作: {bot_name} -> {action_commands}')
-        self.pending_actions[bot_name] = action_commands
-        self.processing_bots.add(bot_name)
+    def __periodic_stats_dump(self):
+        dump = self.config['stats_dump']
+        try:
+            self.dump_stats(dump['format'])
+        except Exception as e:
+            self.log.error('§c写入统计文件失败: %s', e)
+        self.scheduler.call_later(dump['interval'], self.__periodic_stats_dump)
+
+    def dump_stats(self, file_format: str) -> str:
+        """把当前指标追加写入数据目录下的 JSON Lines 或 CSV 文件，返回文件路径"""
+        snapshot = self.stats_snapshot()
+        if file_format == 'csv':
+            # 固定列，便于与 MSPT 等数据对齐作图
+            row = {'time': snapshot['time'], 'uptime': snapshot['uptime'], 'dispatch_rate': snapshot['dispatch_rate']}
+            for name in Metrics.COUNTERS:
+                row[name] = snapshot['counters'].get(name, 0)
+            row.update(snapshot['gauges'])
+            for name in Metrics.HISTOGRAMS:
+                summary = snapshot['histograms'].get(name, {})
+                for key in ('count', 'avg', 'p50', 'p95', 'max'):
+                    row[f'{name}_{key}'] = summary.get(key)
+            path = os.path.join(self.server.get_data_folder(), 'player_batch_stats.csv')
+            exists = os.path.exists(path)
+            with open(path, 'a', newline='', encoding='utf8') as f:
+                writer = csv.DictWriter(f, fieldnames=list(row.keys()))
+                if not exists:
+                    writer.writeheader()
+                writer.writerow(row)
+        else:
+            path = os.path.join(self.server.get_data_folder(), 'player_batch_stats.jsonl')
+            with open(path, 'a', encoding='utf8') as f:
+                f.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+        return path
+
+    def process_stats_command(self, src: CommandSource):
+        snapshot = self.stats_snapshot()
+        counters = snapshot['counters']
+        gauges = snapshot['gauges']
+        lines = [
+            '§6==== PlayerBatch 运行统计 ====',
+            f'§7已分发命令: §e{counters.get("commands_dispatched", 0)} §7最近速率: §e{snapshot["dispatch_rate"]}/秒',
+            f'§7动作超时清理: §e{counters.get("action_timeouts", 0)} §7加入失败: §e{counters.get("join_timeouts", 0)}',
+            f'§7等待动作的假人: §e{gauges["pending_actions"]} §7等待加入: §e{gauges["join_waiters"]} '
+            f'§7运行中任务: §e{gauges["jobs"]}',
+            f'§7调度队列: §e{gauges["scheduler_queue"]} §7工作线程: §e{gauges["worker_threads"]} '
+            f'§7进程线程: §e{gauges["process_threads"]} §7在线玩家: §e{gauges["online_players"]}'
+        ]
+        titles = {'spawn_to_join_ms': '生成→加入', 'join_to_action_ms': '加入→动作'}
+        for name, title in titles.items():
+            summary = snapshot['histograms'].get(name)
+            if summary is not None:
+                lines.append(f'§7{title}延迟(ms): §e平均 {summary["avg"]} p50 {summary["p50"]} '
+                             f'p95 {summary["p95"]} 最大 {summary["max"]} §7({summary["count"]} 次)')
+        src.reply('\n'.join(lines))
+
+    def on_player_left(self, player_name: str):
+        self.roster.discard(player_name)
+        self.release_bot(player_name)
+        self.occupancy.remove(player_name)
+
+    def admit_bot(self, job: Job, bot_name: str, resume) -> bool:
+        """为即将生成的假人占用在线名额
+
+        名额已满时把任务排入等待队列并返回 False，有假人退出后按先后顺序调用 resume() 继续。
+        """
+        limit = self.config['max_online_bots']
+        with self.budget_lock:
+            if self.blocked_spawns:
+                # 丢弃已停止的任务留下的等待项
+                self.blocked_spawns = collections.deque(entry for entry in self.blocked_spawns if entry[0].active)
+            if limit <= 0 or bot_name in self.active_bots or \
+                    (len(self.active_bots) < limit and not self.blocked_spawns):
+                self.active_bots.setdefault(bot_name, time.monotonic())
+                job.blocked = False
+                return True
+            job.blocked = True
+            self.blocked_spawns.append((job, bot_name, resume))
+        self.log.trace('在线假人已达上限 %d，任务 #%d 等待名额生成 %s', limit, job.id, bot_name)
+        return False
+
+    def release_bot(self, bot_name: str):
+        """释放假人占用的在线名额，并让等待中的任务继续生成"""
+        limit = self.config['max_online_bots']
+        admitted = []
+        with self.budget_lock:
+            if self.active_bots.pop(bot_name, None) is None and not self.blocked_spawns:
+                return
+            while self.blocked_spawns and (limit <= 0 or len(self.active_bots) < limit):
+                job, waiting_bot, resume = self.blocked_spawns.popleft()
+                if not job.active:
+                    continue
+                self.active_bots.setdefault(waiting_bot, time.monotonic())
+                job.blocked = any(entry[0] is job for entry in self.blocked_spawns)
+                admitted.append(resume)
+        for resume in admitted:
+            resume()
+
+    def __expire_bots(self):
+        """释放长时间未在线的假人的名额（生成失败或退出事件丢失）"""
+        now = time.monotonic()
+        with self.budget_lock:
+            expired = [bot_name for bot_name, since in self.active_bots.items()
+                       if now - since > BOT_SLOT_EXPIRY and not self.roster.is_online(bot_name)]
+        for bot_name in expired:
+            self.log.trace('假人 %s 长时间不在线，释放在线名额', bot_name)
+            self.release_bot(bot_name)
+
+    def refresh_roster(self, max_age: float = 0) -> bool:
+        """用完整的在线列表对账在线索引；max_age 秒内已对账过则跳过，返回是否成功
+
+        已有查询进行中时不再发起查询，直接使用当前的在线索引，避免多个调度器线程同时阻塞在查询上。
+        """
+        if self.roster.synced and time.monotonic() - self.roster.last_sync < max_age:
+            return True
+        if not self.roster_query_lock.acquire(blocking=False):
+            return self.roster.synced
+        try:
+            online_players = self.query_online_players()
+            if online_players is None:
+                return False
+            self.roster.reconcile(online_players)
+            return True
+        finally:
+            self.roster_query_lock.release()
+
+    def __periodic_roster_sync(self):
+        interval = self.config['roster_sync_interval']
+        if interval <= 0:
+            return
+        if self.refresh_roster(interval / 2):
+            self.__expire_bots()
+            stale = self.occupancy.prune(self.roster.is_online, BOT_SLOT_EXPIRY)
+            if stale:
+                self.log.trace('位置索引中的 %d 个假人已不在线，已移除', len(stale))
+        self.scheduler.call_later(interval, self.__periodic_roster_sync)
 
-        # 设置超时清理（防止假人永远不加入）
-        def cleanup_timeout():
-            time.sleep(10)  # 10秒超时
-            if bot_name in self.pending_actions:
-                # 安全地获取在线玩家列表
+    def on_bot_joined(self, player_name: str):
+        """当假人加入游戏时调用"""
+        self.roster.add(player_name)
+        spawned_at = self.spawn_times.pop(player_name, None)
+        if spawned_at is not None:
+            self.metrics.observe('spawn_to_join_ms', (time.monotonic() - spawned_at) * 1000)
+
+        # 先唤醒等待该假人加入的任务
+        with self.waiter_lock:
+            waiters = self.join_waiters.pop(player_name, [])
+        for waiter in waiters:
+            self.__finish_waiter(waiter, True)
+
+        # pending → joined（重复的加入事件或已超时的假人不会再次执行）
+        record = self.bot_states.transition(player_name, ('pending',), 'joined')
+        if record is None:
+            return
+        self.log.trace('检测到假人 %s 加入游戏，开始执行动作', player_name)
+        # 额外等待0.2秒确保稳定，同一刻内加入的假人的动作合并到同一个桶中发送
+        self.__queue_action(math.ceil((time.monotonic() + 0.2) / ACTION_TICK), [record, 0, time.monotonic()])
+
+    def __queue_action(self, tick: int, entry: list):
+        with self.bucket_lock:
+            bucket = self.action_buckets.get(tick)
+            if bucket is None:
+                bucket = self.action_buckets[tick] = []
+                self.scheduler.call_later(max(tick * ACTION_TICK - time.monotonic(), 0), self.__run_action_bucket, tick)
+            bucket.append(entry)
+
+    def __run_action_bucket(self, tick: int):
+        """一次发送桶内所有假人的下一个动作，每个假人的后续步骤放入两刻（0.1秒）后的桶"""
+        with self.bucket_lock:
+            bucket = self.action_buckets.pop(tick, [])
+        for entry in bucket:
+            record, idx, joined_at = entry
+            player_name, actions = record.bot_name, record.actions
+            if idx == 0:
+                # joined → acting；已停止、丢弃或被新记录替换时跳过
+                if self.bot_states.transition(player_name, ('joined',), 'acting', record) is None:
+                    continue
+                self.metrics.observe('join_to_action_ms', (time.monotonic() - joined_at) * 1000)
+                self.log.trace('开始执行假人 %s 的 %d 个动作', player_name, len(actions))
+            elif not self.bot_states.is_current(record):
+                continue
+
+            if idx < len(actions):
+                action = actions[idx]
                 try:
-                    minecraft_data_api = self.server.get_plugin_instance("minecraft_data_api")
-                    if minecraft_data_api:
-                        online_players = minecraft_data_api.get_server_player_list()
-                    else:
-                        online_players = "Minecraft Data API 未加载"
+                    self.log.trace('执行假人 %s 动作: %s', player_name, action)
+                    self.dispatch(action)
                 except Exception as e:
-                    online_players = f"获取失败: {e}"
+                    self.log.error('§c执行假人 %s 动作失败: %s', player_name, e)
+                entry[1] = idx + 1
+                self.__queue_action(tick + 2, entry)  # 动作间小间隔
+                continue
+
+            if self.bot_states.transition(player_name, ('acting',), 'done', record) is not None:
+                self.log.trace('假人 %s 动作执行完成', player_name)
+                self.__notify_actions_done(record, True)
+
+    def wait_for_join(self, bot_name: str, timeout: float, callback):
+        """等待假人加入游戏
+
+        加入事件到达时立即以 callback(True) 回调，超时以 callback(False) 回调。
+        轮询在线列表只作为兜底，防止加入事件丢失。
+        """
+        waiter = JoinWaiter(bot_name, callback)
+        with self.waiter_lock:
+            self.join_waiters.setdefault(bot_name, []).append(waiter)
+        deadline = time.monotonic() + timeout
+        poll_interval = self.config['join_poll_interval']
+
+        def fallback_poll():
+            if waiter.done:
+                return
+            # 所有等待中的假人共用一次 list 对账，每个轮询周期最多一次
+            self.refresh_roster(poll_interval)
+            if self.roster.is_online(bot_name):
+                self.log.trace('通过轮询检测到假人 %s 在线', bot_name)
+                # 手动触发动作执行
+                return self.on_bot_joined(bot_name)
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                self.scheduler.call_later(min(poll_interval, remaining), fallback_poll)
+            else:
+                self.metrics.incr('join_timeouts')
+                self.__finish_waiter(waiter, False)
+
+        self.scheduler.call_later(min(poll_interval, timeout), fallback_poll)
+
+    def __finish_waiter(self, waiter: 'JoinWaiter', joined: bool):
+        with self.waiter_lock:
+            if waiter.done:
+                return
+            waiter.done = True
+            waiters = self.join_waiters.get(waiter.bot_name)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.join_waiters[waiter.bot_name]
+        self.scheduler.call_soon(waiter.callback, joined)
+
+    def query_online_players(self):
+        """通过 minecraft_data_api 查询在线玩家列表，失败时返回 None"""
+        try:
+            minecraft_data_api = self.server.get_plugin_instance("minecraft_data_api")
+            if minecraft_data_api:
+                return minecraft_data_api.get_server_player_list().players
+        except Exception as e:
+            self.log.error('§c获取在线玩家列表出错: %s', e)
+        return None
 
-                self.server.logger.warning(f'§e假人 {bot_name} 在10秒内未加入游戏，清理动作队列')
-                self.server.logger.warning(f'§e当前在线玩家: {online_players}')
+    def add_bot_action(self, bot_name: str, action_commands: list, on_done=None, timeout: float = 10):
+        """添加假人动作到队列
 
-                del self.pending_actions[bot_name]
-                self.processing_bots.discard(bot_name)
+        on_done(success) 在动作全部执行后以 True 回调，在超时清理或停止时以 False 回调
+        """
+        self.log.trace('添加假人动作: %s -> %s', bot_name, action_commands)
+        record, previous = self.bot_states.add(bot_name, action_commands, on_done)
+        if previous is not None:
+            # 同名假人的旧动作被替换，旧的等待方以失败结束
+            self.__notify_actions_done(previous, False)
 
-        threading.Thread(target=cleanup_timeout, daemon=True).start()
+        # 设置超时清理（防止假人永远不加入），只清理这一次登记的记录
+        def cleanup_timeout():
+            if self.bot_states.transition(bot_name, ('pending',), 'timeout', record) is None:
+                return
+            self.metrics.incr('action_timeouts')
+            self.log.debug('假人 %s 在%s秒内未加入游戏，清理动作队列（当前在线 %d 人，索引中%s该假人）',
+                           bot_name, timeout, len(self.roster), '有' if self.roster.is_online(bot_name) else '没有')
+            self.__notify_actions_done(record, False)
+
+        self.scheduler.call_later(timeout, cleanup_timeout)
+
+    def discard_bot_action(self, bot_name: str):
+        """丢弃假人尚未执行的动作，不触发完成回调"""
+        self.bot_states.discard(bot_name)
+
+    def __notify_actions_done(self, record: BotRecord, success: bool):
+        if record.on_done is not None:
+            self.scheduler.call_soon(record.on_done, success)
+
+    def create_job(self, kind: str, description: str, total: int, src: CommandSource) -> Job:
+        # 按发起者的权限等级确定优先级，控制台最高
+        priority = src.get_permission_level() + (0 if src.is_player else 1)
+        job = Job(next(self.job_ids), kind, description, total, src.player if src.is_player else '控制台',
+                  self.scheduler, self.__remove_job, priority)
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+        return job
+
+    def __remove_job(self, job: Job):
+        with self.jobs_lock:
+            self.jobs.pop(job.id, None)
+        if self.journal is not None:
+            self.journal.end(job.id, job.state)
+        # 每个任务结束时只输出一行摘要，详细过程见 trace
+        self.log.info('§a任务 #%d [%s] %s %s：完成 %d/%d，失败 %d，耗时 %.1f秒',
+                      job.id, job.kind, job.description, '已完成' if job.state == 'finished' else '已停止',
+                      job.done, job.total, job.failures, job.elapsed())
+
+    def process_trace_dump_command(self, src: CommandSource):
+        path = os.path.join(self.server.get_data_folder(), f'trace-{time.strftime("%Y%m%d-%H%M%S")}.log')
+        try:
+            count = self.log.dump(path)
+        except Exception as e:
+            self.log.error('§c导出 trace 失败: %s', e)
+            return src.reply('§c导出 trace 失败，请查看日志')
+        src.reply(f'§a已导出 {count} 条 trace 到 {path}')
+
+    def select_jobs(self, src: CommandSource, ctx: dict) -> list:
+        """按 job_id 参数选择任务，未指定时选择全部任务；找不到时回复错误并返回空列表"""
+        with self.jobs_lock:
+            if 'job_id' not in ctx:
+                return list(self.jobs.values())
+            job = self.jobs.get(ctx['job_id'])
+        if job is None:
+            src.reply(f'§c找不到任务 #{ctx["job_id"]}')
+            return []
+        return [job]
 
     def register_commands(self):
-        def create_command(root: str):
-            return Literal(root) \
-                .requires(lambda src: src.has_permission(self.config['permission'])) \
-                .runs(self.show_help) \
-                .then(
-                QuotableText('name').then(
-                    Integer('start').then(
-                        Integer('end').then(
-                            GreedyText('action_args').runs(self.process_command)
-                        )
+        # 各批量命令的参数树，执行与预览（plan）共用
+        def base_args(handler):
+            return QuotableText('name').then(
+                Integer('start').then(
+                    Integer('end').then(
+                        GreedyText('action_args').runs(handler)
                     )
                 )
-            ).then(
-                Literal('l').then(
-                    QuotableText('name').then(
-                        Integer('start').then(
-                            Integer('length').then(
-                                QuotableText('direction').then(
-                                    Number('interval').runs(self.process_line_command)
-                                )
-                            )
+            )
+
+        def line_args(handler):
+            return QuotableText('name').then(
+                Integer('start').then(
+                    Integer('length').then(
+                        QuotableText('direction').then(
+                            Number('interval').runs(handler)
                         )
                     )
                 )
-            ).then(
-                Literal('s').then(
-                    QuotableText('name').then(
-                        Integer('start').then(
-                            Integer('long').then(
-                                Integer('width').then(
-                                    QuotableText('direction1').then(
-                                        QuotableText('direction2').then(
-                                            Number('interval').runs(self.process_square_command)
-                                        )
-                                    )
+            )
+
+        def square_args(handler):
+            return QuotableText('name').then(
+                Integer('start').then(
+                    Integer('long').then(
+                        Integer('width').then(
+                            QuotableText('direction1').then(
+                                QuotableText('direction2').then(
+                                    Number('interval').runs(handler)
                                 )
                             )
                         )
                     )
                 )
-            ).then(
-                Literal('init').then(
-                    QuotableText('name').then(
-                        Integer('start').then(
-                            Integer('length').then(
-                                Number('interval1').then(
-                                    Number('interval2').then(
-                                        Number('x').then(
-                                            Number('y').then(
-                                                Number('z').then(
-                                                    GreedyText('action').runs(self.process_init_command)
-                                                )
-                                            )
+            )
+
+        def init_args(handler):
+            return QuotableText('name').then(
+                Integer('start').then(
+                    Integer('length').then(
+                        Number('interval1').then(
+                            Number('interval2').then(
+                                Number('x').then(
+                                    Number('y').then(
+                                        Number('z').then(
+                                            GreedyText('action').runs(handler)
                                         )
                                     )
                                 )
@@ -156,8 +1699,68 @@ class PlayerBatch:
                         )
                     )
                 )
+            )
+
+        def plan(handler):
+            return lambda src, ctx: handler(src, ctx, plan=True)
+
+        def create_command(root: str):
+            return Literal(root) \
+                .requires(lambda src: src.has_permission(self.config['permission'])) \
+                .runs(self.show_help) \
+                .then(
+                base_args(self.process_command)
+            ).then(
+                Literal('l').then(line_args(self.process_line_command))
+            ).then(
+                Literal('s').then(square_args(self.process_square_command))
+            ).then(
+                Literal('init').then(init_args(self.process_init_command))
+            ).then(
+                Literal('every').then(
+                    Number('minutes').then(base_args(self.process_every_command))
+                )
+            ).then(
+                Literal('plan').then(
+                    base_args(plan(self.process_command))
+                ).then(
+                    Literal('l').then(line_args(plan(self.process_line_command)))
+                ).then(
+                    Literal('s').then(square_args(plan(self.process_square_command)))
+                ).then(
+                    Literal('init').then(init_args(plan(self.process_init_command)))
+                )
             ).then(  # 新增 stop 命令
-                Literal('stop').runs(self.process_stop_command)
+                Literal('stop').runs(self.process_stop_command).then(
+                    Integer('job_id').runs(self.process_stop_command)
+                )
+            ).then(
+                Literal('pause').runs(self.process_pause_command).then(
+                    Integer('job_id').runs(self.process_pause_command)
+                )
+            ).then(
+                Literal('resume').runs(self.process_resume_command).then(
+                    Integer('job_id').runs(self.process_resume_command)
+                )
+            ).then(
+                Literal('jobs').runs(self.process_jobs_command)
+            ).then(
+                Literal('recover').runs(self.process_recover_command).then(
+                    Integer('job_id').runs(self.process_recover_command)
+                ).then(
+                    Literal('discard').runs(self.process_discard_command).then(
+                        Integer('job_id').runs(self.process_discard_command)
+                    )
+                )
+            ).then(
+                Literal('trace').then(
+                    Literal('dump').runs(self.process_trace_dump_command)
+                )
+            ).then(
+                Literal('stats').runs(self.process_stats_command).then(
+                    Literal('dump').runs(lambda src: src.reply(
+                        f'§a已写入统计文件: {self.dump_stats(self.config["stats_dump"]["format"])}'))
+                )
             )
 
         for cmd in ['!!playerbatch', '!!plb']:
@@ -166,7 +1769,7 @@ class PlayerBatch:
                 "§6批量操作假人 §7输入 §e{} §7查看完整帮助".format(cmd)
             )
             self.server.register_command(create_command(cmd))
-            self.server.logger.info(f'§6已注册命令 {cmd}')
+            self.log.debug('已注册命令 %s', cmd)
 
     def load_config(self):
         try:
@@ -177,14 +1780,76 @@ class PlayerBatch:
 
             with open(self.config_file) as f:
                 self.config = {**DEFAULT_CONFIG, **json.load(f)}
+                # 嵌套配置项逐项合并，缺失的键使用默认值
+                for key, default in DEFAULT_CONFIG.items():
+                    if isinstance(default, dict):
+                        value = self.config[key] if isinstance(self.config[key], dict) else {}
+                        self.config[key] = {**default, **value}
                 if not isinstance(self.config['permission'], int) or self.config['permission'] < 0:
                     self.config['permission'] = 0
                 if not isinstance(self.config['interval'], (int, float)) or self.config['interval'] < 0:
                     self.config['interval'] = 1.0
+                if not isinstance(self.config['workers'], int) or self.config['workers'] < 1:
+                    self.config['workers'] = 4
+                if not isinstance(self.config['join_poll_interval'], (int, float)) or self.config['join_poll_interval'] <= 0:
+                    self.config['join_poll_interval'] = 3.0
+                if not isinstance(self.config['init_window'], int) or self.config['init_window'] < 1:
+                    self.config['init_window'] = 1
+                if not isinstance(self.config['max_online_bots'], int) or self.config['max_online_bots'] < 0:
+                    self.config['max_online_bots'] = 0
+                if not isinstance(self.config['max_command_rate'], (int, float)) or self.config['max_command_rate'] < 0:
+                    self.config['max_command_rate'] = 0
+                if self.config['log_level'] not in LOG_LEVELS:
+                    self.config['log_level'] = 'info'
+                if not isinstance(self.config['trace_size'], int) or self.config['trace_size'] < 1:
+                    self.config['trace_size'] = 2000
+                if not isinstance(self.config['roster_sync_interval'], (int, float)) or self.config['roster_sync_interval'] < 0:
+                    self.config['roster_sync_interval'] = 60.0
+                if not isinstance(self.config['skip_offline_bots'], bool):
+                    self.config['skip_offline_bots'] = False
+                if not isinstance(self.config['repeat_jitter'], (int, float)) or not 0 <= self.config['repeat_jitter'] <= 1:
+                    self.config['repeat_jitter'] = 0.5
+                if not isinstance(self.config['use_rcon'], bool):
+                    self.config['use_rcon'] = False
+                adaptive = self.config['adaptive_interval']
+                if adaptive['bound'] not in ('floor', 'ceiling'):
+                    adaptive['bound'] = 'ceiling'
+                for key in ('target_mspt', 'min_interval', 'max_interval', 'sample_period'):
+                    if not isinstance(adaptive[key], (int, float)) or adaptive[key] < 0:
+                        adaptive[key] = DEFAULT_CONFIG['adaptive_interval'][key]
+                occupancy = self.config['occupancy']
+                if occupancy['policy'] not in ('refuse', 'shift', 'skip'):
+                    occupancy['policy'] = 'refuse'
+                if not isinstance(occupancy['cell_size'], (int, float)) or occupancy['cell_size'] <= 0:
+                    occupancy['cell_size'] = 1.0
+                if not isinstance(occupancy['max_shift'], int) or occupancy['max_shift'] < 1:
+                    occupancy['max_shift'] = 64
+                bulk = self.config['bulk_dispatch']
+                for key in ('min_batch', 'chunk_size', 'pack_format', 'cache_size'):
+                    if not isinstance(bulk[key], int) or bulk[key] < 1:
+                        bulk[key] = DEFAULT_CONFIG['bulk_dispatch'][key]
+                if not isinstance(bulk['reload_delay'], (int, float)) or bulk['reload_delay'] < 0:
+                    bulk['reload_delay'] = DEFAULT_CONFIG['bulk_dispatch']['reload_delay']
+                chunk_order = self.config['chunk_order']
+                for key in ('enabled', 'forceload'):
+                    if not isinstance(chunk_order[key], bool):
+                        chunk_order[key] = DEFAULT_CONFIG['chunk_order'][key]
+                if not isinstance(chunk_order['max_forceload_chunks'], int) or chunk_order['max_forceload_chunks'] < 1:
+                    chunk_order['max_forceload_chunks'] = DEFAULT_CONFIG['chunk_order']['max_forceload_chunks']
+                journal = self.config['journal']
+                if not isinstance(journal['enabled'], bool):
+                    journal['enabled'] = True
+                if not isinstance(journal['flush_interval'], (int, float)) or journal['flush_interval'] <= 0:
+                    journal['flush_interval'] = DEFAULT_CONFIG['journal']['flush_interval']
+                stats_dump = self.config['stats_dump']
+                if not isinstance(stats_dump['interval'], (int, float)) or stats_dump['interval'] < 0:
+                    stats_dump['interval'] = 0
+                if stats_dump['format'] not in ('json', 'csv'):
+                    stats_dump['format'] = 'json'
             self.save_config()
         except Exception as e:
-            self.server.logger.error(f'§c配置加载失败: {e}')
-            self.config = DEFAULT_CONFIG.copy()
+            self.log.error('§c配置加载失败: %s', e)
+            self.config = json.loads(json.dumps(DEFAULT_CONFIG))
 
     def save_config(self):
         with open(self.config_file, 'w') as f:
@@ -203,62 +1868,485 @@ class PlayerBatch:
             '§7!!plb s <名称> <起始> <长> <宽> <方向1> <方向2> <间隔> §e- 生成二维排列假人',
             '§6初始化序列:',
             '§7!!plb init <名称> <起始> <长度> <间隔1> <间隔2> <x> <y> <z> <动作> §e- 生成假人并依次执行动作和退出，间隔控制',
-            '§6停止命令:',  # 新增停止命令帮助
-            '§7!!plb stop §e- 停止所有正在执行的假人生成',
+            f'§e当前初始化并行窗口: §a{self.config["init_window"]} §7(配置项 init_window)',
+            '§6重复任务:',
+            '§7!!plb every <分钟> <名称> <起始> <结束> <动作> §e- 每隔指定分钟重新执行一次基础命令，命令分散在整个周期内，'
+            '用 !!plb stop <任务ID> 取消',
+            '§6任务管理:',  # 新增停止命令帮助
+            '§7!!plb jobs §e- 查看正在执行的任务、进度和剩余时间',
+            '§7!!plb stop [任务ID] §e- 停止指定任务，不指定时停止所有任务',
+            '§7!!plb pause [任务ID] §e- 暂停指定任务，不指定时暂停所有任务',
+            '§7!!plb resume [任务ID] §e- 恢复指定任务，不指定时恢复所有任务',
+            '§7!!plb plan <l|s|init|名称> ... §e- 预览批量命令的命令数、预计耗时、峰值在线和涉及区块，不执行',
+            '§7!!plb recover [任务ID] §e- 查看重载或重启前中断的任务，指定任务ID时从下一个假人继续',
+            '§7!!plb recover discard [任务ID] §e- 丢弃中断的任务，不指定时丢弃全部',
+            '§7!!plb stats [dump] §e- 查看运行统计，dump 写入数据目录下的统计文件',
+            '§7!!plb trace dump §e- 把最近的详细执行记录导出到数据目录',
             '§e示例:',
             '§7!!plb l bot 1 5 +x 1 §e- 生成bot1到bot5，每个向东间隔1格',
             '§7!!plb s bot 1 2 3 +x +z 1 §e- 生成bot1到bot6，在X/Z平面形成2x3方阵',
             '§7!!plb init bot 1 3 1 2 0 100 0 kill §e- 生成bot1-3在(0,100,0)，每个生成后立即kill，间隔1秒后退出，间隔2秒处理下一个',
-            f'§a当前生成间隔: §e{self.config["interval"]}秒'
+            '§7!!plb every 10 bot 1 200 use §e- 每10分钟让bot1到bot200执行一次 use',
+            f'§a当前生成间隔: §e{self.interval_text()}'
         ]
         src.reply('\n'.join(help_msg))
 
-    def process_stop_command(self, src: CommandSource):
-        """停止所有正在执行的命令"""
+    def process_stop_command(self, src: CommandSource, ctx: dict = None):
+        """停止指定任务，未指定任务ID时停止所有正在执行的命令"""
+        ctx = ctx or {}
         try:
-            # 设置停止标志
-            self.stop_cmd = True
+            jobs = self.select_jobs(src, ctx)
+            if not jobs and 'job_id' in ctx:
+                return
+            for job in jobs:
+                job.stop()
 
-            # 记录被停止的假人数量
-            stopped_count = len(self.pending_actions)
-            stopped_bots = list(self.pending_actions.keys())
+            if 'job_id' in ctx:
+                return src.reply(f'§a已停止任务 #{ctx["job_id"]}')
 
-            # 清空队列
-            self.pending_actions.clear()
-            self.processing_bots.clear()
+            # 停止所有假人的动作，记录被停止生成的假人数量
+            stopped_count = self.bot_states.count('pending')
+            records = self.bot_states.clear()
+            for record in records:
+                self.__notify_actions_done(record, False)
 
             # 回复用户
-            src.reply('§a已发送停止信号，将停止后续假人生成')
+            src.reply(f'§a已停止 {len(jobs)} 个任务')
             if stopped_count > 0:
-                self.server.logger.info(
-                    f'§a用户 {src.player if src.is_player else "控制台"} 停止了 {stopped_count} 个假人的生成')
+                self.log.info('§a用户 %s 停止了 %d 个假人的生成', src.player if src.is_player else '控制台', stopped_count)
 
         except Exception as e:
-            self.server.logger.error(f'§c停止命令执行出错: {str(e)}')
+            self.log.error('§c停止命令执行出错: %s', e)
             src.reply('§c停止命令执行失败，请查看日志')
 
-    def __execute_commands(self, commands: list, src: CommandSource, reply_msg: str, use_interval: bool):
-        def task():
+    def process_pause_command(self, src: CommandSource, ctx: dict = None):
+        jobs = self.select_jobs(src, ctx or {})
+        paused = [job.id for job in jobs if job.pause()]
+        src.reply(f'§a已暂停任务: {", ".join(f"#{i}" for i in paused)}' if paused else '§e没有可暂停的任务')
+
+    def process_resume_command(self, src: CommandSource, ctx: dict = None):
+        jobs = self.select_jobs(src, ctx or {})
+        resumed = [job.id for job in jobs if job.resume()]
+        src.reply(f'§a已恢复任务: {", ".join(f"#{i}" for i in resumed)}' if resumed else '§e没有可恢复的任务')
+
+    def process_jobs_command(self, src: CommandSource):
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        if not jobs:
+            return src.reply('§7当前没有正在执行的任务')
+        lines = ['§6==== 正在执行的任务 ====']
+        if self.config['max_online_bots'] > 0:
+            blocked = sum(1 for job in jobs if job.blocked)
+            lines.append(f'§7在线假人 §e{len(self.active_bots)}/{self.config["max_online_bots"]}'
+                         + (f' §c{blocked} 个任务等待名额' if blocked else ''))
+        src.reply('\n'.join(lines + [job.status_text() for job in jobs]))
+
+    def process_recover_command(self, src: CommandSource, ctx: dict = None):
+        """列出中断的任务，指定任务ID时从最后完成的假人之后继续执行"""
+        ctx = ctx or {}
+        if self.journal is None:
+            return src.reply('§c任务日志未启用（配置项 journal.enabled）')
+        with self.journal.lock:
+            interrupted = dict(self.journal.interrupted)
+        if 'job_id' not in ctx:
+            if not interrupted:
+                return src.reply('§7没有中断的任务')
+            lines = ['§6==== 中断的任务 ====']
+            for job_id, entry in sorted(interrupted.items()):
+                total = len(BatchSpec.from_dict(entry['spec']))
+                lines.append(f'§6#{job_id} §7[{entry["kind"]}] §f{entry["description"]} §7已完成 §e{entry.get("done", 0)}/{total} '
+                             f'§7发起者 {entry["owner"]}')
+            return src.reply('\n'.join(lines))
+
+        job_id = ctx['job_id']
+        entry = interrupted.get(job_id)
+        if entry is None:
+            return src.reply(f'§c找不到中断的任务 #{job_id}')
+        try:
+            spec = BatchSpec.from_dict(entry['spec'])
+            spec.skip += entry.get('done', 0)
+            if spec.executor is not None and self.roster.synced and not self.roster.is_online(spec.executor):
+                return src.reply(f'§c任务 #{job_id} 的发起者 {spec.executor} 不在线，无法按原位置恢复')
+            if spec.formation is not None and spec.executor is not None:
+                # 需要查询发起者的位置，在调度器线程中继续
+                return self.scheduler.call_soon(self.__recover_job, src, job_id, entry, spec)
+            self.__recover_job(src, job_id, entry, spec)
+        except Exception as e:
+            self.log.error('§c恢复任务出错: %s', e)
+            src.reply('§c恢复任务失败，请查看日志')
+
+    def __recover_job(self, src: CommandSource, job_id: int, entry: dict, spec: BatchSpec):
+        """按日志中的参数重新创建任务，从下一个假人继续执行"""
+        try:
+            if spec.formation is not None and spec.executor is not None:
+                if spec.formation.get('origin') is None:
+                    src.reply(f'§e任务 #{job_id} 创建时没有记录发起者的位置，剩余假人将以发起者当前的位置为原点生成')
+                else:
+                    reason = self.relocate_formation(spec)
+                    if reason is not None:
+                        return src.reply(f'§c{reason}，无法按原位置恢复任务 #{job_id}')
+            with self.journal.lock:
+                if job_id not in self.journal.interrupted:
+                    return src.reply(f'§c找不到中断的任务 #{job_id}')
+            self.release_interrupted_forceload(entry)
+            self.journal.end(job_id, 'recovered')
+            if len(spec) == 0:
+                return src.reply(f'§a任务 #{job_id} 的假人均已完成，无需恢复')
+
+            job = self.create_job(entry['kind'], entry['description'], len(spec), src)
+            if entry.get('period') is not None:
+                # 重复任务没有进度，恢复时从下一轮重新开始
+                job.period = entry['period']
+                self.journal_job(job, spec, entry['reply'], entry['use_interval'])
+                src.reply(f'§a重复任务 #{job_id} 已恢复为任务 #{job.id}')
+                return self.__run_every(spec, src, job)
+            self.journal_job(job, spec, entry['reply'], entry['use_interval'], entry['init'])
+            src.reply(f'§a任务 #{job_id} 已恢复为任务 #{job.id}，从 {spec.bot_name(next(iter(spec.indices())))} 继续，剩余 {len(spec)} 个')
+            if entry['kind'] == 'init':
+                return self.__run_init(src, spec, entry['init'], job)
+            if not entry['use_interval'] and self.can_bulk_dispatch(spec):
+                return self.__bulk_dispatch(spec, src, entry['reply'], job)
+            self.__execute_commands(spec, src, entry['reply'], entry['use_interval'], job)
+        except Exception as e:
+            self.log.error('§c恢复任务出错: %s', e)
+            src.reply('§c恢复任务失败，请查看日志')
+
+    def process_discard_command(self, src: CommandSource, ctx: dict = None):
+        ctx = ctx or {}
+        if self.journal is None:
+            return src.reply('§c任务日志未启用（配置项 journal.enabled）')
+        with self.journal.lock:
+            interrupted = dict(self.journal.interrupted)
+        job_ids = list(interrupted.keys())
+        if 'job_id' in ctx:
+            if ctx['job_id'] not in job_ids:
+                return src.reply(f'§c找不到中断的任务 #{ctx["job_id"]}')
+            job_ids = [ctx['job_id']]
+        for job_id in job_ids:
+            self.release_interrupted_forceload(interrupted[job_id])
+            self.journal.end(job_id, 'discarded')
+        src.reply(f'§a已丢弃 {len(job_ids)} 个中断的任务')
+
+    def __execute_commands(self, spec: BatchSpec, src: CommandSource, reply_msg: str, use_interval: bool, job: Job):
+        """按 spec 的执行顺序逐条生成并分发命令"""
+        indices = iter(spec.indices())
+        job.stop_hooks.append(lambda: src.reply(f'§a任务 #{job.id} 已停止后续假人生成，已完成 {job.done}/{job.total}'))
+        if spec.formation is not None and self.config['chunk_order']['forceload']:
+            self.__forceload_chunks(spec, job)
+
+        def step(i):
+            # 每一步发送一条命令，之后重新排队，与其他任务轮流使用发送名额
             try:
-                for idx, cmd in enumerate(commands):
-                    # 检查停止标志
-                    if self.stop_cmd:
-                        self.stop_cmd = False  # 重置停止标志
-                        self.server.logger.info('§a检测到停止信号，停止执行后续命令')
-                        src.reply('§a已停止后续假人生成')
-                        return
+                if i is not None:
+                    if spec.spawns and not self.admit_bot(job, spec.bot_name(i),
+                                                          lambda: self.dispatcher.submit(job, step, i)):
+                        return  # 在线名额已满，有假人退出后继续
+                    self.dispatch(spec.command(i))
+                    if spec.spawns and spec.formation is not None:
+                        self.track_position(spec, i)
+                    job.done += 1
+                    job.checkpoint = job.done
+                    i = next(indices, None)
+                if i is None:
+                    job.finish()
+                    return src.reply(reply_msg)
+                interval = self.next_interval() if use_interval else 0
+                if interval > 0:
+                    # 等待间隔；任务暂停或停止时由 job 挂起或丢弃后续步骤
+                    return job.later(interval, self.dispatcher.submit, job, step, i)
+                self.dispatcher.submit(job, step, i)
+            except Exception as e:
+                job.stop()
+                self.log.error('§c命令执行出错: %s', e)
+                src.reply('§c命令执行失败，请查看日志')
+
+        self.dispatcher.submit(job, step, next(indices, None))
+
+    def __run_every(self, spec: BatchSpec, src: CommandSource, job: Job):
+        """重复任务：每个周期向 spec 中的假人重新发送一次命令
+
+        每条命令占周期中的一个时间片，在时间片内随机抖动（配置项 repeat_jitter），避免同一刻发出整批命令。
+        每一步只在调度器中保留下一条命令的等待，停止任务即取消整个计划。
+        """
+        job.stop_hooks.append(lambda: src.reply(f'§a重复任务 #{job.id} 已取消，共执行 {job.cycles} 轮'))
+        jitter = self.config['repeat_jitter']
+
+        def offset(position: int, slot: float) -> float:
+            return (position + random.uniform(0, jitter)) * slot
+
+        def cycle():
+            try:
+                job.cycles += 1
+                job.done = 0
+                only = self.online_only(spec)
+                cycle_spec = BatchSpec.from_dict({**spec.to_dict(), 'only': only})
+                indices = cycle_spec.indices()
+                job.total = len(indices)
+                if not indices:
+                    self.log.trace('重复任务 #%d 第 %d 轮：假人均不在线，跳过', job.id, job.cycles)
+                    return job.later(job.period, cycle)
+                slot = job.period / len(indices)
+                at = offset(0, slot)
+                job.later(at, self.dispatcher.submit, job, step, cycle_spec, indices, 0, slot, at)
+            except Exception as e:
+                job.stop()
+                self.log.error('§c重复任务执行出错: %s', e)
+                src.reply('§c重复任务执行失败，请查看日志')
+
+        def step(cycle_spec: BatchSpec, indices: list, position: int, slot: float, at: float):
+            # at 为本条命令在周期内的时间点，等待只按相邻两条的差值计算，暂停不会导致恢复后集中发送
+            try:
+                i = indices[position]
+                if cycle_spec.spawns and not self.admit_bot(
+                        job, cycle_spec.bot_name(i),
+                        lambda: self.dispatcher.submit(job, step, cycle_spec, indices, position, slot, at)):
+                    return  # 在线名额已满，有假人退出后继续
+                self.dispatch(cycle_spec.command(i))
+                job.done += 1
+                if position + 1 < len(indices):
+                    next_at = offset(position + 1, slot)
+                    return job.later(next_at - at, self.dispatcher.submit, job, step, cycle_spec, indices,
+                                     position + 1, slot, next_at)
+                self.log.trace('重复任务 #%d 第 %d 轮已发送 %d 条命令', job.id, job.cycles, job.done)
+                job.later(max(job.period - at, 0), cycle)
+            except Exception as e:
+                job.stop()
+                self.log.error('§c重复任务执行出错: %s', e)
+                src.reply('§c重复任务执行失败，请查看日志')
+
+        cycle()
+
+    def __forceload_chunks(self, spec: BatchSpec, job: Job):
+        """执行前强制加载阵列剩余假人所在的区块，任务结束、停止或插件卸载时释放
+
+        释放命令记录在任务日志中，服务端在任务中途重启时，恢复或丢弃任务会释放上次加载的区块。
+        玩家执行时使用记录的位置换算出的绝对坐标，玩家移动后仍释放同一批区块。
+        """
+        groups = spec.chunk_firsts()
+        limit = self.config['chunk_order']['max_forceload_chunks']
+        if len(groups) > limit:
+            return self.log.warning('§e任务 #%d 涉及 %d 个区块，超过 max_forceload_chunks (%d)，不预加载区块',
+                                    job.id, len(groups), limit)
+        if spec.executor is not None and spec.formation.get('origin') is None:
+            return self.log.warning('§e无法获取任务 #%d 发起者的位置，不预加载区块', job.id)
+        dimension = spec.formation.get('dimension')
+        dimension = LEGACY_DIMENSIONS.get(dimension, dimension)
+
+        def forceload(operation: str, chunk: tuple, first: int) -> str:
+            if spec.executor is None:
+                x_offset, z_offset = spec.offset(first)
+                return f'/forceload {operation} ~{x_offset} ~{z_offset}'
+            target = f'forceload {operation} {chunk[0] * 16} {chunk[1] * 16}'
+            if dimension is None:
+                return f'/execute as {spec.executor} at @s run {target}'
+            return f'/execute in {dimension} run {target}'
+
+        for chunk, first in groups.items():
+            self.dispatch(forceload('add', chunk, first))
+        job.forceloaded = [forceload('remove', chunk, first) for chunk, first in groups.items()]
+        if self.journal is not None:
+            self.journal.forceload(job.id, job.forceloaded)
+        job.end_hooks.append(lambda: self.release_forceload(job))
+        self.log.trace('任务 #%d 已强制加载 %d 个区块', job.id, len(groups))
+
+    def release_forceload(self, job: Job):
+        """释放任务强制加载的区块，只执行一次"""
+        commands, job.forceloaded = job.forceloaded, []
+        for command in commands:
+            self.dispatch(command)
+
+    def release_interrupted_forceload(self, entry: dict):
+        """释放中断的任务在日志中记录的强制加载区块"""
+        commands = entry.get('forceload') or []
+        for command in commands:
+            self.dispatch(command)
+        if commands:
+            self.log.info('§a已释放中断的任务 #%d 强制加载的 %d 个区块', entry['id'], len(commands))
+
+    def __datapack_folder(self) -> str:
+        working_directory = self.server.get_mcdr_config().get('working_directory', 'server')
+        return os.path.join(working_directory, self.config['bulk_dispatch']['world'], 'datapacks', DATAPACK_NAME)
+
+    def __function_folders(self) -> list:
+        """生成的函数文件目录（1.21 之前为 functions，之后为 function）"""
+        pack = self.__datapack_folder()
+        return [os.path.join(pack, 'data', DATAPACK_NAME, folder) for folder in ('functions', 'function')]
+
+    def __write_datapack(self, lines, function_names: list, chunk_size: int, probe: str):
+        folders = self.__function_folders()
+        pack = self.__datapack_folder()
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+        mcmeta = os.path.join(pack, 'pack.mcmeta')
+        if not os.path.exists(mcmeta):
+            with open(mcmeta, 'w', encoding='utf8') as f:
+                json.dump({'pack': {
+                    'pack_format': self.config['bulk_dispatch']['pack_format'],
+                    'supported_formats': {'min_inclusive': 4, 'max_inclusive': 999},
+                    'description': 'PlayerBatch generated functions'
+                }}, f, indent=4)
+
+        lines = iter(lines)
+        # 探测函数只有一行注释，执行它不会产生任何效果，用于确认这一组函数已加载
+        contents = [''.join(f'{line}\n' for _, line in zip(range(chunk_size), lines)) for _ in function_names]
+        for function_name, content in zip(function_names + [probe], contents + ['# PlayerBatch probe\n']):
+            for folder in folders:
+                path = os.path.join(folder, f'{function_name}.mcfunction')
+                with open(path + '.tmp', 'w', encoding='utf8') as f:
+                    f.write(content)
+                os.replace(path + '.tmp', path)
+
+    def can_bulk_dispatch(self, spec: BatchSpec) -> bool:
+        """能否通过数据包函数执行：函数覆盖整个序号范围，因此只用于没有在线过滤、从分块边界开始的批量"""
+        bulk = self.config['bulk_dispatch']
+        return bulk['enabled'] and spec.only is None and spec.skip % bulk['chunk_size'] == 0 \
+            and len(spec) >= bulk['min_batch']
+
+    def __prune_functions(self, keep: str):
+        """删除不再使用的批量函数文件，保留最近使用的 cache_size 组和正在执行的任务的函数"""
+        folders = self.__function_folders()
+        used = {}  # {key: 最近使用时间}
+        for filename in os.listdir(folders[-1]):
+            match = FUNCTION_FILE_PATTERN.fullmatch(filename)
+            if match is not None:
+                mtime = os.path.getmtime(os.path.join(folders[-1], filename))
+                used[match.group(1)] = max(used.get(match.group(1), 0), mtime)
+        with self.jobs_lock:
+            keep_keys = {keep, *self.bulk_keys}
+        keep_keys.update(sorted(used, key=used.get, reverse=True)[:self.config['bulk_dispatch']['cache_size']])
+        removed = 0
+        for folder in folders:
+            for filename in os.listdir(folder):
+                match = FUNCTION_FILE_PATTERN.fullmatch(filename)
+                if match is not None and match.group(1) not in keep_keys:
+                    os.remove(os.path.join(folder, filename))
+                    removed += 1
+        if removed:
+            self.log.trace('已清理 %d 个过期的批量函数文件', removed)
+
+    def check_function_probe(self, text: str):
+        """从控制台输出中识别探测函数的执行反馈"""
+        match = PROBE_OUTPUT_PATTERN.search(text)
+        if match is not None:
+            report = self.function_probes.get(match.group())
+            if report is not None:
+                report(function_loaded(text))
+
+    def probe_function(self, function: str, job: Job, callback):
+        """执行探测函数，以 callback(True / False / None) 报告函数已加载、不存在或无法确认
+
+        RCON 可用时直接读取执行结果，否则等待控制台中的反馈，FUNCTION_CONFIRM_TIMEOUT 秒内没有反馈视为无法确认。
+        """
+        def report(loaded):
+            if self.function_probes.pop(function, None) is not None:
+                job.later(0, callback, loaded)
+
+        self.function_probes[function] = report
+        result = self.dispatch(f'/function {function}')
+        if result is not None:
+            return report(function_loaded(result))
+        job.later(FUNCTION_CONFIRM_TIMEOUT, report, None)
+
+    def __bulk_dispatch(self, spec: BatchSpec, src: CommandSource, reply_msg: str, job: Job):
+        """将同一模板的一组命令写入数据包函数，确认函数已加载后每刻执行一个分块
+
+        函数文件以模板和序号范围为键缓存，重复执行时直接复用，无需 reload；写入新函数时清理最久未使用的函数。
+        执行前先调用这一组的探测函数确认已加载，reload 尚未完成时等待 reload_delay 秒后重试；函数不存在
+        （如 bulk_dispatch.world 与服务端的存档名不一致）或无法确认时，从当前位置改为逐条发送命令。
+        恢复的任务（skip 为分块的整数倍）从下一个分块继续。
+        """
+        bulk = self.config['bulk_dispatch']
+        chunk_size = bulk['chunk_size']
+        key = spec.key()
+        full = BatchSpec.from_dict({**spec.to_dict(), 'only': None, 'skip': 0})
+        chunk_count = (len(full) - 1) // chunk_size + 1
+        first_chunk = spec.skip // chunk_size
+        function_names = [f'batch_{key}_{idx}' for idx in range(chunk_count)]
+        probe = f'batch_{key}_probe'
+
+        folder = self.__function_folders()[-1]
+        paths = [os.path.join(folder, f'{fn}.mcfunction') for fn in function_names + [probe]]
+        cached = all(os.path.exists(path) for path in paths)
+        with self.jobs_lock:
+            self.bulk_keys[key] += 1
+
+        def release_key():
+            with self.jobs_lock:
+                self.bulk_keys[key] -= 1
+                if self.bulk_keys[key] <= 0:
+                    del self.bulk_keys[key]
+
+        job.end_hooks.append(release_key)
+        job.end_hooks.append(lambda: self.function_probes.pop(f'{DATAPACK_NAME}:{probe}', None))
+        delay = 0
+        if cached:
+            # 更新使用时间，清理缓存时按最近使用保留
+            for path in paths:
+                os.utime(path)
+        else:
+            # 函数文件中的命令不能以 / 开头
+            lines = (cmd.lstrip('/') for cmd in full.commands())
+            self.__write_datapack(lines, function_names, chunk_size, probe)
+            self.__prune_functions(key)
+            self.dispatch('/reload')
+            delay = bulk['reload_delay']
+            self.log.info('§6已生成 %d 个批量函数文件，等待数据包重载', chunk_count)
+
+        fallback = [False]
+
+        def on_stop():
+            if not fallback[0]:
+                src.reply(f'§a任务 #{job.id} 已停止后续批量函数，已完成 {job.done}/{job.total}')
+
+        job.stop_hooks.append(on_stop)
+
+        def fall_back(skip: int, reason: str):
+            # 从执行顺序中第 skip 个假人开始逐条发送，进度接着已完成的分块
+            fallback[0] = True
+            self.log.warning('§e任务 #%d 的批量函数%s，改为逐条发送命令', job.id, reason)
+            self.__execute_commands(BatchSpec.from_dict({**spec.to_dict(), 'skip': skip}), src, reply_msg, False, job)
 
-                    if use_interval and idx > 0 and self.config['interval'] > 0:
-                        time.sleep(self.config['interval'])
-                    self.server.execute(cmd)
-                src.reply(reply_msg)
+        def probe_functions(attempt: int, reloaded: bool):
+            self.probe_function(f'{DATAPACK_NAME}:{probe}', job, lambda loaded: on_probe(loaded, attempt, reloaded))
+
+        def on_probe(loaded, attempt: int, reloaded: bool):
+            try:
+                if loaded:
+                    return self.dispatcher.submit(job, run_chunk, first_chunk)
+                if loaded is None:
+                    return fall_back(spec.skip, '无法确认是否已加载')
+                if attempt + 1 >= FUNCTION_PROBE_ATTEMPTS:
+                    return fall_back(spec.skip, '未能加载（请检查 bulk_dispatch.world 是否为服务端的存档名）')
+                if not reloaded:
+                    self.dispatch('/reload')
+                job.later(bulk['reload_delay'], probe_functions, attempt + 1, True)
             except Exception as e:
-                self.server.logger.error(f'§c命令执行出错: {str(e)}')
+                job.stop()
+                self.log.error('§c命令执行出错: %s', e)
                 src.reply('§c命令执行失败，请查看日志')
 
-        threading.Thread(target=task, daemon=True).start()
+        def run_chunk(idx: int):
+            # 分块经过发送队列，按其中的命令数占用全局名额
+            try:
+                cost = min(chunk_size, len(full) - idx * chunk_size)
+                result = self.dispatch(f'/function {DATAPACK_NAME}:{function_names[idx]}', cost)
+                if result is not None and not function_loaded(result):
+                    return fall_back(idx * chunk_size, '未能执行')
+                job.done = min(job.total, (idx + 1) * chunk_size - spec.skip)
+                job.checkpoint = job.done
+                if idx + 1 < chunk_count:
+                    job.later(0.05, self.dispatcher.submit, job, run_chunk, idx + 1)  # 每刻一个分块
+                else:
+                    job.finish()
+                    src.reply(reply_msg)
+            except Exception as e:
+                job.stop()
+                self.log.error('§c命令执行出错: %s', e)
+                src.reply('§c命令执行失败，请查看日志')
 
-    def process_command(self, src: CommandSource, ctx: dict):
+        job.later(delay, probe_functions, 0, not cached)
+
+    def process_command(self, src: CommandSource, ctx: dict, plan: bool = False):
         try:
             name = ctx['name']
             start = ctx['start']
@@ -269,31 +2357,116 @@ class PlayerBatch:
             if start > end:
                 return src.reply('§c错误：起始值不能大于结束值')
 
-            is_spawn = action_args.strip().lower().startswith('spawn')
+            spec = BatchSpec(f'{base}{name}', start, end, action_args, src.player if src.is_player else None)
+            is_spawn = spec.spawns
             use_interval = is_spawn
-            interval_info = f'（间隔 {self.config["interval"]}秒）' if is_spawn else ''
-
-            commands = []
-            for i in range(start, end + 1):
-                bot_name = f'{base}{name}{i}'
-                if src.is_player:
-                    player_name = src.player
-                    cmd = f'/execute as {player_name} at @s run player {bot_name} {action_args}'
-                else:
-                    cmd = f'/player {bot_name} {action_args}'
-                commands.append(cmd)
-
-            self.__execute_commands(
-                commands,
-                src,
-                f'§a已操作假人 {base}{name}[{start}-{end}] 的 {action_args} 指令{interval_info}',
-                use_interval
-            )
+            interval_info = f'（间隔 {self.interval_text()}）' if is_spawn else ''
+
+            spec.only = self.online_only(spec)
+            if spec.only == []:
+                return src.reply(f'§e假人 {base}{name}[{start}-{end}] 均不在线')
+            if plan:
+                return self.report_plan(src, 'base', spec, use_interval)
+            reply_msg = f'§a已操作假人 {base}{name}[{start}-{end}] 的 {action_args} 指令{interval_info}'
+            job = self.create_job('base', f'{base}{name}[{start}-{end}] {action_args}', len(spec), src)
+            self.journal_job(job, spec, reply_msg, use_interval)
+
+            # 无需间隔的动作可通过数据包函数批量执行
+            if not use_interval and self.can_bulk_dispatch(spec):
+                return self.__bulk_dispatch(spec, src, reply_msg, job)
+
+            self.__execute_commands(spec, src, reply_msg, use_interval, job)
+
+        except Exception as e:
+            self.log.error('§c执行出错: %s', e)
+            src.reply('§c命令执行失败，请查看日志')
+
+    def online_only(self, spec: BatchSpec):
+        """开启 skip_offline_bots 时返回范围内在线假人的序号，不需要过滤时返回 None"""
+        if spec.spawns or not self.config['skip_offline_bots'] or not self.roster.synced:
+            return None
+        # 只向在线的假人发送命令，全部在线时不需要过滤
+        only = self.roster.select(spec.name_prefix, spec.start, spec.end)
+        return None if len(only) == spec.end - spec.start + 1 else only
+
+    def process_every_command(self, src: CommandSource, ctx: dict):
+        """创建重复任务，每隔指定分钟按基础命令的参数重新执行一次"""
+        try:
+            minutes = ctx['minutes']
+            name = ctx['name']
+            start = ctx['start']
+            end = ctx['end']
+            action_args = ctx['action_args']
+            base = self.config['base_name']
+
+            if minutes <= 0:
+                return src.reply('§c错误：周期必须大于0分钟')
+            if start > end:
+                return src.reply('§c错误：起始值不能大于结束值')
+
+            # 每轮的在线过滤在开始时重新计算，这里保存完整范围
+            spec = BatchSpec(f'{base}{name}', start, end, action_args, src.player if src.is_player else None)
+            job = self.create_job('every', f'{base}{name}[{start}-{end}] {action_args}', len(spec), src)
+            job.period = minutes * 60
+            self.journal_job(job, spec, use_interval=False)
+            src.reply(f'§a已创建重复任务 #{job.id}：每 {minutes:g} 分钟操作假人 {base}{name}[{start}-{end}] 的 {action_args} 指令，'
+                      f'使用 !!plb stop {job.id} 取消')
+            self.__run_every(spec, src, job)
 
         except Exception as e:
-            self.server.logger.error(f'§c执行出错: {str(e)}')
+            self.log.error('§c执行出错: %s', e)
             src.reply('§c命令执行失败，请查看日志')
 
+    def report_plan(self, src: CommandSource, kind: str, spec: BatchSpec, use_interval: bool = True,
+                    init: dict = None, notes: list = None):
+        """只编译任务不执行：命令由与实际执行相同的代码生成，报告数量、预计耗时、峰值在线、区块和重名"""
+        bots = len(spec)
+        interval = self.rate_controller.interval if self.rate_controller is not None else self.config['interval']
+        chunk_order = self.config['chunk_order']
+        notes = list(notes or [])
+        if init is None:
+            commands = sum(1 for _ in spec.commands())
+            duration = max(bots - 1, 0) * interval if use_interval else 0.0
+            peak = bots if spec.spawns else 0
+            chunks = None
+            if spec.formation is not None:
+                chunks = len(spec.chunk_firsts())
+                if chunk_order['forceload'] and chunks <= chunk_order['max_forceload_chunks']:
+                    commands += chunks * 2
+        else:
+            commands = sum(len(self.init_commands(spec, init, spec.bot_name(i))) for i in spec.indices())
+            window = min(self.config['init_window'], bots)
+            # 单个假人：生成→加入→稳定0.2秒→动作→动作间隔→退出，窗口内并行
+            join_ms = self.metrics.snapshot()['histograms'].get('spawn_to_join_ms', {}).get('p50')
+            join = join_ms / 1000 if join_ms is not None else 1.0
+            notes.append(f'§7加入延迟按 {join:.2f}秒 估算' + ('（来自运行统计）' if join_ms is not None else ''))
+            cycle = join + 0.3 + init['interval1'] + init['interval2']
+            duration = math.ceil(bots / window) * cycle
+            peak = window
+            chunks = 1
+        if self.config['max_command_rate'] > 0:
+            duration = max(duration, commands / self.config['max_command_rate'])
+
+        limit = self.config['max_online_bots']
+        if limit > 0 and peak > 0:
+            available = max(limit - len(self.active_bots), 0)
+            if peak > available:
+                notes.append(f'§e峰值在线超过剩余名额 {available}/{limit}，部分假人需要排队等待')
+        if spec.spawns or init is not None:
+            # init 的 action 是生成后的动作，但每个假人同样会被生成
+            collisions = self.roster.online_among(spec.bot_name(i) for i in spec.indices())
+            if collisions:
+                shown = ', '.join(collisions[:10]) + (' ...' if len(collisions) > 10 else '')
+                notes.append(f'§c{len(collisions)} 个假人名称已在线: {shown}')
+
+        src.reply('\n'.join([
+            f'§6==== 任务预览 [{kind}] {spec.name_prefix}[{spec.start}-{spec.end}] {spec.action} ====',
+            f'§7假人数量 §e{bots} §7命令数量 §e{commands} §7预计耗时 §e{duration:.1f}秒',
+            f'§7峰值在线 §e{peak} §7涉及区块 §e{chunks if chunks is not None else "执行位置所在区块"}',
+            *notes,
+            '§7未执行任何命令'
+        ]))
+
     def parse_direction(self, direction: str):
         valid = {
             '+x': ('x', 1),
@@ -303,7 +2476,146 @@ class PlayerBatch:
         }
         return valid.get(direction, (None, None))
 
-    def process_line_command(self, src: CommandSource, ctx: dict):
+    def formation_params(self, src: CommandSource) -> dict:
+        """阵列的位置和执行顺序参数
+
+        玩家执行时记录其位置和维度，使区块分组与实际区块边界对齐，用于检查与已有假人的重叠，
+        并在恢复任务时换算到玩家的新位置；开启 chunk_order 时按区块分组执行。
+        """
+        params = {'order': 'chunk'} if self.config['chunk_order']['enabled'] else {}
+        origin, dimension = self.player_position(src.player) if src.is_player else (None, None)
+        return {**params, 'origin': origin, 'dimension': dimension}
+
+    def player_position(self, player: str):
+        """通过 MinecraftDataAPI 查询玩家的 ([x, z], 维度)，失败时为 None；不能在命令线程中调用"""
+        origin = None
+        dimension = None
+        minecraft_data_api = self.server.get_plugin_instance('minecraft_data_api')
+        try:
+            if minecraft_data_api:
+                position = minecraft_data_api.get_player_coordinate(player)
+                origin = [position.x, position.z]
+        except Exception as e:
+            self.log.debug('获取玩家 %s 的位置失败: %s', player, e)
+        try:
+            if minecraft_data_api and origin is not None:
+                dimension = str(minecraft_data_api.get_player_dimension(player))
+        except Exception as e:
+            self.log.debug('获取玩家 %s 的维度失败: %s', player, e)
+        return origin, dimension
+
+    def relocate_formation(self, spec: BatchSpec):
+        """玩家执行的阵列以玩家当前位置为原点（at @s），恢复前把偏移换算到玩家的新位置，使剩余假人仍生成在
+        原来的位置；无法换算时返回原因"""
+        formation = spec.formation
+        origin = formation.get('origin')
+        if origin is None:
+            return None
+        position, dimension = self.player_position(spec.executor)
+        if position is None:
+            return f'无法获取发起者 {spec.executor} 的位置'
+        if formation.get('dimension') is not None and dimension != formation['dimension']:
+            return f'发起者 {spec.executor} 不在任务原来的维度'
+        shift_x, shift_z = formation.get('shift') or (0, 0)
+        formation['shift'] = [shift_x + origin[0] - position[0], shift_z + origin[1] - position[1]]
+        formation['origin'] = position
+        return None
+
+    def track_position(self, spec: BatchSpec, i: int):
+        """记录阵列中已生成的假人的位置"""
+        position = spec.position(i)
+        if position is not None and self.config['occupancy']['enabled']:
+            self.occupancy.add(spec.bot_name(i), spec.formation.get('dimension'), *position)
+
+    def occupancy_conflicts(self, spec: BatchSpec, limit: int = None) -> list:
+        """阵列中与已记录的假人位置重叠的 [(序号, 占用者)]，最多返回 limit 个"""
+        dimension = spec.formation.get('dimension')
+        # 阵列的四个角确定范围，范围内没有记录的假人时无需逐个检查
+        width = spec.formation.get('width', 1)
+        last_row = spec.start + (spec.end - spec.start) // width * width
+        corners = [spec.position(i) for i in {spec.start, min(spec.start + width - 1, spec.end), last_row, spec.end}]
+        xs = [x for x, _ in corners]
+        zs = [z for _, z in corners]
+        if not self.occupancy.any_within(dimension, min(xs), min(zs), max(xs), max(zs)):
+            return []
+        conflicts = []
+        for i in spec.only if spec.only is not None else range(spec.start, spec.end + 1):
+            occupant = self.occupancy.occupant(spec.bot_name(i), dimension, *spec.position(i))
+            if occupant is not None:
+                conflicts.append((i, occupant))
+                if limit is not None and len(conflicts) >= limit:
+                    break
+        return conflicts
+
+    def resolve_occupancy(self, spec: BatchSpec):
+        """按 occupancy.policy 处理阵列与已有假人的重叠
+
+        返回 (处理后的 spec, 提示)：refuse 拒绝，shift 沿阵列的排列方向整体平移到没有重叠的位置，
+        skip 跳过已被占用的位置。无法处理时 spec 为 None。执行位置未知（如控制台执行）时不检查。
+        """
+        occupancy = self.config['occupancy']
+        if not occupancy['enabled'] or spec.formation.get('origin') is None:
+            return spec, None
+        conflicts = self.occupancy_conflicts(spec)
+        if not conflicts:
+            return spec, None
+        i, occupant = conflicts[0]
+        overlap = f'§c阵列中 {len(conflicts)} 个位置已有假人，如 {spec.bot_name(i)} 与 {occupant} 重叠'
+        data = spec.to_dict()
+
+        if occupancy['policy'] == 'skip':
+            occupied = {i for i, _ in conflicts}
+            free = [i for i in range(spec.start, spec.end + 1) if i not in occupied]
+            if not free:
+                return None, '§c阵列的所有位置都已有假人'
+            return BatchSpec.from_dict({**data, 'only': free}), f'§e已跳过 {len(occupied)} 个已有假人的位置'
+
+        if occupancy['policy'] == 'shift':
+            # 直线向垂直方向平移，方阵沿第一个方向平移
+            formation = spec.formation
+            if formation['type'] == 'line':
+                axis, sign = ('z' if formation['axis'] == 'x' else 'x'), 1
+            else:
+                axis, sign = formation['axis1'], formation['sign1']
+            step = max(formation['spacing'], occupancy['cell_size'])
+            for n in range(1, occupancy['max_shift'] + 1):
+                distance = n * step * sign
+                shifted = BatchSpec.from_dict({**data, 'formation': {
+                    **formation, 'shift': [distance, 0] if axis == 'x' else [0, distance]}})
+                if not self.occupancy_conflicts(shifted, limit=1):
+                    direction = f'{"+" if sign > 0 else "-"}{axis}'
+                    return shifted, f'§e阵列与已有假人重叠，已向 {direction} 方向平移 {n * step:g} 格'
+            return None, f'{overlap}，平移 {occupancy["max_shift"]} 次后仍有重叠'
+
+        return None, f'{overlap}（配置项 occupancy.policy 为 refuse，可改为 shift 或 skip）'
+
+    def __start_formation(self, src: CommandSource, kind: str, spec: BatchSpec, description: str, reply_msg: str,
+                          plan: bool):
+        """在调度器线程中补充执行者的位置，再检查重叠并预览或执行阵列
+
+        MinecraftDataAPI 的查询要等待服务端输出，在 MCDR 的命令线程中无法完成。
+        """
+        title = {'l': '直线生成', 's': '方阵生成'}[kind]
+        try:
+            spec.formation.update(self.formation_params(src))
+            resolved, note = self.resolve_occupancy(spec)
+            if plan:
+                notes = [f'{note}，执行时将被拒绝' if resolved is None else note] if note else None
+                return self.report_plan(src, kind, resolved or spec, notes=notes)
+            if resolved is None:
+                return src.reply(f'{note}，未生成假人')
+            spec = resolved
+            if note:
+                src.reply(note)
+
+            job = self.create_job(kind, description, len(spec), src)
+            self.journal_job(job, spec, reply_msg)
+            self.__execute_commands(spec, src, reply_msg, True, job)
+        except Exception as e:
+            self.log.error('§c%s出错: %s', title, e)
+            src.reply(f'§c{title}失败，请查看日志')
+
+    def process_line_command(self, src: CommandSource, ctx: dict, plan: bool = False):
         try:
             name = ctx['name']
             start = ctx['start']
@@ -320,35 +2632,17 @@ class PlayerBatch:
             if axis is None:
                 return src.reply(f'§c错误的方向参数：{direction}')
 
-            commands = []
-            for i in range(start, end + 1):
-                bot_name = f'{base}{name}{i}'
-                offset = (i - start) * interval * sign
-                if axis == 'x':
-                    coord = f'~{offset} ~ ~'
-                else:
-                    coord = f'~ ~ ~{offset}'
-
-                full_action = 'spawn'
-                if src.is_player:
-                    player_name = src.player
-                    cmd = f'/execute as {player_name} at @s positioned {coord} positioned over world_surface run player {bot_name} {full_action}'
-                else:
-                    cmd = f'/execute positioned {coord} positioned over world_surface run player {bot_name} {full_action}'
-                commands.append(cmd)
-
-            self.__execute_commands(
-                commands,
-                src,
-                f'§a成功生成直线假人 {base}{name}[{start}-{end}]，方向 {direction} 间隔 {interval}格（命令间隔 {self.config["interval"]}秒）',
-                True
-            )
+            spec = BatchSpec(f'{base}{name}', start, end, 'spawn', src.player if src.is_player else None,
+                             {'type': 'line', 'axis': axis, 'sign': sign, 'spacing': interval})
+            reply_msg = f'§a成功生成直线假人 {base}{name}[{start}-{end}]，方向 {direction} 间隔 {interval}格（命令间隔 {self.interval_text()}）'
+            self.scheduler.call_soon(self.__start_formation, src, 'l', spec, f'{base}{name}[{start}-{end}] {direction}',
+                                     reply_msg, plan)
 
         except Exception as e:
-            self.server.logger.error(f'§c直线生成出错: {str(e)}')
+            self.log.error('§c直线生成出错: %s', e)
             src.reply('§c直线生成失败，请查看日志')
 
-    def process_square_command(self, src: CommandSource, ctx: dict):
+    def process_square_command(self, src: CommandSource, ctx: dict, plan: bool = False):
         try:
             name = ctx['name']
             start = ctx['start']
@@ -369,57 +2663,23 @@ class PlayerBatch:
             if None in [axis1, axis2]:
                 return src.reply(f'§c错误的方向参数：{dir1} 或 {dir2}')
 
-            commands = []
-            for idx in range(total):
-                i = start + idx
-                bot_name = f'{base}{name}{i}'
-
-                x_offset = 0.0
-                z_offset = 0.0
-                row = idx // width
-                col = idx % width
-
-                if axis1 == 'x':
-                    x_offset += row * interval * sign1
-                elif axis1 == 'z':
-                    z_offset += row * interval * sign1
-
-                if axis2 == 'x':
-                    x_offset += col * interval * sign2
-                elif axis2 == 'z':
-                    z_offset += col * interval * sign2
-
-                coord = f'~{x_offset} ~ ~{z_offset}'
-                full_action = 'spawn'
-
-                if src.is_player:
-                    player_name = src.player
-                    cmd = f'/execute as {player_name} at @s positioned {coord} positioned over world_surface run player {bot_name} {full_action}'
-                else:
-                    cmd = f'/execute positioned {coord} positioned over world_surface run player {bot_name} {full_action}'
-                commands.append(cmd)
-
-            self.__execute_commands(
-                commands,
-                src,
-                f'§a成功生成方阵假人 {base}{name}[{start}-{end}]，方向 {dir1}×{dir2} 间隔 {interval}格（命令间隔 {self.config["interval"]}秒）',
-                True
-            )
+            spec = BatchSpec(f'{base}{name}', start, end, 'spawn', src.player if src.is_player else None, {
+                'type': 'square', 'width': width, 'spacing': interval,
+                'axis1': axis1, 'sign1': sign1, 'axis2': axis2, 'sign2': sign2
+            })
+            reply_msg = f'§a成功生成方阵假人 {base}{name}[{start}-{end}]，方向 {dir1}×{dir2} 间隔 {interval}格（命令间隔 {self.interval_text()}）'
+            self.scheduler.call_soon(self.__start_formation, src, 's', spec, f'{base}{name}[{start}-{end}] {long}×{width}',
+                                     reply_msg, plan)
 
         except Exception as e:
-            self.server.logger.error(f'§c方阵生成出错: {str(e)}')
+            self.log.error('§c方阵生成出错: %s', e)
             src.reply('§c方阵生成失败，请查看日志')
 
-    def process_init_command(self, src: CommandSource, ctx: dict):
+    def process_init_command(self, src: CommandSource, ctx: dict, plan: bool = False):
         try:
             name = ctx['name']
             start = ctx['start']
             length = ctx['length']
-            interval1 = ctx['interval1']  # 动作间隔
-            interval2 = ctx['interval2']  # 循环间隔
-            x = ctx['x']
-            y = ctx['y']
-            z = ctx['z']
             action = ctx['action'].strip()
             base = self.config['base_name']
 
@@ -427,95 +2687,189 @@ class PlayerBatch:
                 return src.reply('§c错误：长度必须≥1')
             end = start + length - 1
 
-            # 重置停止标志
-            self.stop_cmd = False
+            spec = BatchSpec(f'{base}{name}', start, end, action, src.player if src.is_player else None)
+            params = {key: ctx[key] for key in ('interval1', 'interval2', 'x', 'y', 'z')}
+            if plan:
+                return self.report_plan(src, 'init', spec, init=params)
+            job = self.create_job('init', f'{base}{name}[{start}-{end}] {action}', length, src)
+            self.journal_job(job, spec, init=params)
+            self.__run_init(src, spec, params, job)
 
-            def task():
-                try:
-                    for i in range(start, start + length):
-                        # 检查停止标志
-                        if self.stop_cmd:
-                            self.stop_cmd = False  # 重置停止标志
-                            self.server.logger.info('§a检测到停止信号，停止执行后续假人生成')
-                            src.reply(f'§a已停止假人生成，当前完成到 {base}{name}{i - 1}')
-                            return
-
-                        bot_name = f'{base}{name}{i}'
-                        self.server.logger.info(f'§6[DEBUG] 开始处理假人: {bot_name}')
-
-                        # 生成假人命令
-                        if src.is_player:
-                            player_name = src.player
-                            spawn_cmd = f'/execute as {player_name} at @s positioned {x} {y} {z} run player {bot_name} spawn'
-                            kill_cmd = f'/execute as {player_name} at @s run player {bot_name} kill'
-                        else:
-                            spawn_cmd = f'/execute positioned {x} {y} {z} run player {bot_name} spawn'
-                            kill_cmd = f'/player {bot_name} kill'
-
-                        # 动作命令
-                        action_cmd = f'/player {bot_name} {action}'
-
-                        # 准备动作队列
-                        action_commands = [action_cmd]
-                        self.add_bot_action(bot_name, action_commands)
-
-                        # 执行生成命令
-                        self.server.logger.info(f'§a执行生成命令: {spawn_cmd}')
-                        self.server.execute(spawn_cmd)
-
-                        # 方法1：轮询检测假人是否在线
-                        self.server.logger.info(f'§6[DEBUG] 开始轮询检测假人 {bot_name} 是否在线')
-                        joined = False
-                        for attempt in range(30):  # 最多检测30次，每次0.5秒，总共15秒
-                            # 检查停止标志
-                            if self.stop_cmd:
-                                self.stop_cmd = False  # 重置停止标志
-                                self.server.logger.info('§a检测到停止信号，停止执行后续假人生成')
-                                src.reply(f'§a已停止假人生成，当前完成到 {base}{name}{i - 1}')
-                                return
-
-                            time.sleep(0.5)
-                            try:
-                                minecraft_data_api = self.server.get_plugin_instance("minecraft_data_api")
-                                if minecraft_data_api:
-                                    online_players = minecraft_data_api.get_server_player_list()
-                                    if bot_name in online_players.players:
-                                        self.server.logger.info(f'§a[SUCCESS] 通过轮询检测到假人 {bot_name} 在线')
-                                        # 手动触发动作执行
-                                        self.on_bot_joined(bot_name)
-                                        joined = True
-                                        break
-                            except Exception as e:
-                                self.server.logger.error(f'§c轮询检测出错: {e}')
-
-                        if not joined:
-                            self.server.logger.warning(f'§e假人 {bot_name} 在15秒内未检测到在线')
-
-                        if interval1 > 0:
-                            self.server.logger.info(f'§6等待动作间隔 {interval1} 秒')
-                            time.sleep(interval1)
-
-                        # 执行kill命令
-                        self.server.logger.info(f'§a执行kill命令: {kill_cmd}')
-                        self.server.execute(kill_cmd)
-
-                        # 循环间隔（最后一个假人不等待）
-                        if i != end:
-                            time.sleep(interval2)
-
-                    src.reply(
-                        f'§a成功处理假人序列 {base}{name}[{start}-{end}]，动作间隔 {interval1}秒，循环间隔 {interval2}秒')
+        except Exception as e:
+            self.log.error('§c初始化命令解析出错: %s', e)
+            src.reply('§c命令格式错误，请查看日志')
 
-                except Exception as e:
-                    self.server.logger.error(f'§c初始化命令执行出错: {str(e)}')
-                    src.reply('§c初始化命令执行失败，请查看日志')
+    def init_commands(self, spec: BatchSpec, params: dict, bot_name: str):
+        """初始化序列中一个假人的 (生成, 动作, 退出) 命令"""
+        x, y, z = params['x'], params['y'], params['z']
+        if spec.executor is not None:
+            player_name = spec.executor
+            spawn_cmd = f'/execute as {player_name} at @s positioned {x} {y} {z} run player {bot_name} spawn'
+            kill_cmd = f'/execute as {player_name} at @s run player {bot_name} kill'
+        else:
+            spawn_cmd = f'/execute positioned {x} {y} {z} run player {bot_name} spawn'
+            kill_cmd = f'/player {bot_name} kill'
+        return spawn_cmd, f'/player {bot_name} {spec.action}', kill_cmd
+
+    def __run_init(self, src: CommandSource, spec: BatchSpec, params: dict, job: Job):
+        """依次生成假人、执行动作并退出；params 为动作间隔、循环间隔和生成坐标"""
+        interval1 = params['interval1']  # 动作间隔
+        interval2 = params['interval2']  # 循环间隔
+        total = len(spec)
+
+        # 流水线窗口：最多 window 个假人同时处于生成→动作→退出的不同阶段
+        window = min(self.config['init_window'], total)
+        pending = iter(spec.indices())
+        state_lock = threading.Lock()
+        state = {
+            'next': next(pending, None),  # 下一个待生成的序号
+            'launched': 0,  # 已生成的假人数量
+            'launch_pending': False  # 是否已安排下一次生成
+        }
+        positions = {}  # {序号: 在执行顺序中的位置}
+        in_flight = set()  # 已生成但尚未退出的序号
+        advanced = set()  # 已进入退出阶段的序号
 
-            threading.Thread(target=task, daemon=True).start()
+        def later(delay: float, step, *args):
+            job.later(delay, run_step, step, *args)
 
-        except Exception as e:
-            self.server.logger.error(f'§c初始化命令解析出错: {str(e)}')
-            src.reply('§c命令格式错误，请查看日志')
+        def run_step(step, *args):
+            try:
+                step(*args)
+            except Exception as e:
+                job.stop()
+                self.log.error('§c初始化命令执行出错: %s', e)
+                src.reply('§c初始化命令执行失败，请查看日志')
+
+        def commands_of(bot_name: str):
+            spawn_cmd, _, kill_cmd = self.init_commands(spec, params, bot_name)
+            return spawn_cmd, kill_cmd
+
+        def on_stop():
+            # 停止时立即让进行中的假人退出，不再等待剩余间隔
+            with state_lock:
+                remaining = sorted(in_flight)
+                in_flight.clear()
+            for i in remaining:
+                bot_name = spec.bot_name(i)
+                self.discard_bot_action(bot_name)
+                self.dispatch(commands_of(bot_name)[1])
+            self.log.trace('任务 #%d 检测到停止信号，停止执行后续假人生成', job.id)
+            src.reply(f'§a任务 #{job.id} 已停止假人生成，已完成 {job.done}/{total} 个，{len(remaining)} 个进行中的假人已退出')
+
+        job.stop_hooks.append(on_stop)
+
+        def launch():
+            with state_lock:
+                state['launch_pending'] = False
+                i = state['next']
+                state['next'] = next(pending, None)
+                positions[i] = state['launched']
+                state['launched'] += 1
+                in_flight.add(i)
+                if state['next'] is not None and len(in_flight) < window:
+                    state['launch_pending'] = True
+                    later(interval2, launch)
+            # 生成命令与其他任务轮流使用发送名额
+            self.dispatcher.submit(job, run_step, spawn, i)
+
+        def spawn(i: int):
+            bot_name = spec.bot_name(i)
+            if not self.admit_bot(job, bot_name, lambda: self.dispatcher.submit(job, run_step, spawn, i)):
+                return  # 在线名额已满，有假人退出后继续
+            self.log.trace('开始处理假人: %s', bot_name)
+            spawn_cmd, _ = commands_of(bot_name)
+
+            # 动作命令
+            _, action_cmd, _ = self.init_commands(spec, params, bot_name)
+
+            # 准备动作队列，动作执行完成（或超时）后才进入退出阶段
+            action_commands = [action_cmd]
+            self.add_bot_action(bot_name, action_commands,
+                                on_done=lambda success: later(0, advance, i, success), timeout=15)
+
+            # 等待加入事件（轮询仅作兜底），最多等待15秒；生成失败时会立即以失败回调
+            self.wait_for_join(bot_name, 15, lambda joined: later(0, on_join_result, i, joined))
+
+            # 执行生成命令
+            self.log.trace('执行生成命令: %s', spawn_cmd)
+            self.dispatch(spawn_cmd)
+
+        def on_join_result(i: int, joined: bool):
+            if not joined:
+                job.failures += 1
+                self.log.debug('假人 %s 未能加入游戏，跳过', spec.bot_name(i))
+                advance(i, False)
+
+        def advance(i: int, success: bool = True):
+            with state_lock:
+                if i in advanced:
+                    return
+                advanced.add(i)
+            # 失败的假人不再等待动作间隔，直接进入下一个
+            if success and interval1 > 0:
+                self.log.trace('假人 %s 等待动作间隔 %s 秒', spec.bot_name(i), interval1)
+                return later(interval1, kill, i)
+            kill(i)
+
+        def kill(i: int):
+            with state_lock:
+                if i not in in_flight:
+                    return
+                in_flight.discard(i)
+            _, kill_cmd = commands_of(spec.bot_name(i))
+            # 执行kill命令
+            self.log.trace('执行kill命令: %s', kill_cmd)
+            self.dispatch(kill_cmd)
+
+            with state_lock:
+                job.done += 1
+                finished = job.done == total
+                # 进行中的假人可能乱序完成，只记录其之前均已完成的数量
+                job.checkpoint = min(positions[j] for j in in_flight) if in_flight else state['launched']
+                # 窗口空出位置后安排下一个假人（循环间隔）
+                if state['next'] is not None and not state['launch_pending']:
+                    state['launch_pending'] = True
+                    later(interval2, launch)
+            if finished:
+                job.finish()
+                sequence = f'{spec.name_prefix}[{spec.start}-{spec.end}]'
+                # 生成失败或未能加入的假人被跳过，不算作成功
+                result = (f'§e已处理假人序列 {sequence}，其中 {job.failures}/{total} 个假人未能加入游戏' if job.failures
+                          else f'§a成功处理假人序列 {sequence}')
+                src.reply(f'{result}，动作间隔 {interval1}秒，循环间隔 {interval2}秒'
+                          + (f'，并行窗口 {window}' if window > 1 else ''))
+
+        later(0, launch)
+
+# 插件实例，卸载或重载时用于关闭调度器并写入任务日志
+player_batch_instance = None
 
 
 def on_load(server: PluginServerInterface, old):
-    PlayerBatch(server).on_load()
\ No newline at end of file
+    global player_batch_instance
+    player_batch_instance = PlayerBatch(server)
+    player_batch_instance.on_load()
+
+
+def on_unload(server: PluginServerInterface):
+    global player_batch_instance
+    if player_batch_instance is not None:
+        player_batch_instance.on_unload()
+    player_batch_instance = None
+
+
+def on_player_joined(server: PluginServerInterface, player: str, info: Info):
+    if player_batch_instance is not None:
+        player_batch_instance.on_bot_joined(player)
+
+
+def on_player_left(server: PluginServerInterface, player: str):
+    if player_batch_instance is not None:
+        player_batch_instance.on_player_left(player)
+
+
+def on_info(server: PluginServerInterface, info: Info):
+    # 服务端输出，用于识别 Carpet 错误反馈和解析 MSPT
+    if player_batch_instance is not None:
+        player_batch_instance.on_info(info)
\ No newline at end of file